@@ -0,0 +1,41 @@
+'''
+Matching lines of a large log file streamed serially, against scanning
+memory mapped chunks of it in a pool of processes with ``jobs=N``.
+'''
+import os
+import sys
+import tempfile
+
+from common import best_of, report
+from snagit.core import Interpreter
+
+SCRIPT = r'matches ERROR r"timeout \d{3,}" jobs='
+
+
+def run(filename, jobs):
+    interp = Interpreter(history=False)
+    interp.execute('load {} stream=True\n{}'.format(
+        filename, SCRIPT + str(jobs)
+    ))
+    with open(os.devnull, 'w') as fp:
+        interp.contents.write(fp)
+
+
+def main(count=2000000, jobs=os.cpu_count() or 1):
+    fd, filename = tempfile.mkstemp(suffix='.log')
+    with os.fdopen(fd, 'w') as fp:
+        for i in range(count):
+            fp.write('{} request {} timeout {}\n'.format(
+                'ERROR' if i % 97 == 0 else 'INFO', i, i % 5000
+            ))
+
+    try:
+        for n in sorted({1, jobs}):
+            elapsed = best_of(run, filename, n, repeat=3)
+            report('jobs={} {} lines'.format(n, count), elapsed, count)
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,40 @@
+'''
+Break-even point of the per-document element index: building it costs one
+tree walk, after which each simple selector is a dictionary lookup.
+'''
+import sys
+
+from common import best_of, report
+from snagit.lib.soup import Soup
+
+ROW = (
+    '<tr class="r{0}"><td class="c">{0}</td>'
+    '<td id="x{0}"><a>{0}</a></td></tr>'
+)
+SELECTORS = ('td', '.c', 'a', 'tr.r5', '#x7', 'td.c')
+
+
+def run(soup, count, indexed):
+    if indexed:
+        soup.changed()
+        soup.build_index()
+    else:
+        soup.drop_index()
+
+    for i in range(count):
+        soup.select(SELECTORS[i % len(SELECTORS)])
+
+
+def main(rows=2000):
+    soup = Soup('<table>{}</table>'.format(
+        ''.join(ROW.format(i) for i in range(rows))
+    ))
+    for count in (1, 2, 5, 10, 20):
+        plain = best_of(run, soup, count, False, repeat=3)
+        indexed = best_of(run, soup, count, True, repeat=3)
+        report('{} selects, traversal'.format(count), plain)
+        report('{} selects, indexed'.format(count), indexed)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,46 @@
+'''
+Decoding a large JSON array from a file: all at once with ``json.load``
+against item by item with ``iter_values``, reading 64k chunks.
+'''
+import os
+import sys
+import json
+import tempfile
+
+from common import measure, report
+from snagit.lib.jsondata import iter_values
+
+
+def read_chunks(filename, size=2 ** 16):
+    with open(filename, encoding='utf8') as fp:
+        for chunk in iter(lambda: fp.read(size), ''):
+            yield chunk
+
+
+def load_all(filename):
+    with open(filename, encoding='utf8') as fp:
+        return len(json.load(fp))
+
+
+def load_stream(filename):
+    return sum(1 for item in iter_values(read_chunks(filename)))
+
+
+def main(count=200000):
+    fd, filename = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w') as fp:
+        json.dump([
+            {'id': i, 'name': 'item {}'.format(i), 'tags': ['a', 'b']}
+            for i in range(count)
+        ], fp)
+
+    try:
+        for name, func in (('json.load', load_all), ('stream', load_stream)):
+            result, elapsed, peak = measure(func, filename)
+            report('{} {} items'.format(name, result), elapsed, count, peak)
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
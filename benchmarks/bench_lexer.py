@@ -0,0 +1,36 @@
+'''
+Lexing generated scripts with very long lines: ``replace_each`` with many
+terms, and large ``j'...'`` JSON literals. The time per token should stay
+flat as the lines grow.
+'''
+import sys
+import json
+
+from common import best_of, report
+from snagit.core import lexer
+
+
+def terms_script(count):
+    terms = ' '.join('term{}'.format(i) for i in range(count))
+    return 'replace_each _ {} r"x+" strip=True\n'.format(terms) * 10
+
+
+def json_script(count):
+    value = [{'id': i, 'name': 'item {}'.format(i)} for i in range(count)]
+    return "json j'{}'\n".format(json.dumps(value)) * 10
+
+
+def run(script):
+    return list(lexer(script))
+
+
+def main(count=20000):
+    for size in (count // 4, count // 2, count):
+        for name, make in [('terms', terms_script), ('json', json_script)]:
+            script = make(size)
+            elapsed = best_of(run, script, repeat=3)
+            report('{} {}'.format(name, size), elapsed, 10 * size)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,46 @@
+'''
+Line commands on a large log, held as one buffer plus line offsets,
+against the same steps on a plain list of line strings.
+'''
+import sys
+
+import strutil
+from common import best_of, measure, report
+from snagit.lib.lines import Lines
+
+
+def make_log(count):
+    return '\n'.join(
+        '2019-01-01 00:00:{:02d} {} request {}'.format(
+            i % 60, 'ERROR' if i % 97 == 0 else 'INFO', i
+        )
+        for i in range(count)
+    )
+
+
+def run_list(text, marker):
+    lines = text.splitlines()
+    found = strutil.find_first(lines, marker)
+    lines = lines[found:]
+    lines = [line for line in lines if strutil.matches(line, 'ERROR')]
+    return len(lines)
+
+
+def run_lines(text, marker):
+    lines = Lines(text)
+    lines = lines[lines.find(marker):]
+    lines = lines.subset(lines.iter_matches('ERROR'))
+    return len(lines)
+
+
+def main(count=1000000):
+    text = make_log(count)
+    marker = 'request {}'.format(count // 2)
+    for name, func in (('list of str', run_list), ('offsets', run_lines)):
+        peak = measure(func, text, marker)[2]
+        elapsed = best_of(func, text, marker, repeat=3)
+        report('{} {} lines'.format(name, count), elapsed, count, peak)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
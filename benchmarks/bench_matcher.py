@@ -0,0 +1,60 @@
+'''
+Filtering lines on many keywords: one ``strutil.matches`` call per pattern
+and line, against a single ``Matcher``, both on a line stream and on
+``Lines``, where the combined pattern searches the whole buffer.
+'''
+import sys
+import random
+from functools import partial
+
+import strutil
+from common import best_of, report
+from snagit.lib.lines import Lines, LineStream, matches
+
+
+def make_lines(count):
+    rnd = random.Random(0)
+    words = ['user{}'.format(i) for i in range(5000)]
+    return [
+        '{} GET /item/{} {}'.format(i, rnd.randrange(1000), rnd.choice(words))
+        for i in range(count)
+    ]
+
+
+def per_pattern(lines, keywords):
+    return sum(
+        1 for line in lines
+        if any(strutil.matches(line, word) for word in keywords)
+    )
+
+
+def run(data, keywords, kws):
+    return len(list(matches(iter([data]), keywords, kws)[0]))
+
+
+def main(count=1000000, patterns=200):
+    lines = make_lines(count)
+    keywords = ['user{}'.format(i * 7) for i in range(patterns)]
+    text = Lines('\n'.join(lines))
+    stream = LineStream(partial(iter, lines))
+    report(
+        '{} patterns, per pattern'.format(patterns),
+        best_of(per_pattern, lines, keywords, repeat=1),
+        count
+    )
+    for mode in ('any', 'all', 'none'):
+        kws = {'mode': mode}
+        report(
+            '{} patterns, {}, stream'.format(patterns, mode),
+            best_of(run, stream, keywords, kws, repeat=1),
+            count
+        )
+        report(
+            '{} patterns, {}, Lines'.format(patterns, mode),
+            best_of(run, text, keywords, kws, repeat=1),
+            count
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
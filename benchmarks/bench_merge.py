@@ -0,0 +1,32 @@
+'''
+Merging many pages, with history kept (each page is copied) and without
+(each page's tree is moved into the result).
+'''
+import sys
+
+from common import measure, report
+from snagit.core import Interpreter
+
+PAGE = '<div>{}</div>'.format(''.join(
+    '<p class="c">para {}</p>'.format(i) for i in range(50)
+))
+
+
+def run(pages, history):
+    interp = Interpreter([PAGE] * pages, history=history)
+    interp.execute('parse\nselect p\nmerge')
+    return interp
+
+
+def main(pages=300):
+    for history in (True, False):
+        result, elapsed, peak = measure(run, pages, history)
+        report(
+            'merge {} pages, history={}'.format(pages, history),
+            elapsed,
+            peak=peak
+        )
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
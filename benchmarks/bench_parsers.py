@@ -0,0 +1,55 @@
+'''
+Compare parse time, peak memory and ``select`` results across the bs4
+parsers over a corpus of pages::
+
+    $ python benchmarks/bench_parsers.py page1.html page2.html ...
+
+Defaults to ``tests/some.html`` when no pages are given.
+'''
+import sys
+
+import bs4
+from common import best_of, measure, report
+from snagit import utils
+
+PARSERS = ('html.parser', 'lxml', 'html5lib')
+SELECTORS = ('*', 'a', 'p', 'div', 'td', 'li a')
+
+
+def corpus(filenames):
+    return [(f, utils.read_file(f)) for f in filenames]
+
+
+def main(filenames):
+    pages = corpus(filenames or ['tests/some.html'])
+    size = sum(len(text) for _, text in pages)
+    print('{} page(s), {} chars'.format(len(pages), size))
+    counts = {}
+    for parser in PARSERS:
+        try:
+            bs4.BeautifulSoup('', parser)
+        except bs4.FeatureNotFound:
+            print('{:<48} not installed'.format(parser))
+            continue
+
+        def parse_all():
+            return [bs4.BeautifulSoup(t, parser) for _, t in pages]
+
+        soups, secs, peak = measure(parse_all)
+        report(parser, best_of(parse_all), len(pages), peak)
+        counts[parser] = [
+            [len(soup.select(sel)) for soup in soups] for sel in SELECTORS
+        ]
+
+    baseline = counts.get(PARSERS[0])
+    for parser, results in counts.items():
+        for sel, found in zip(SELECTORS, results):
+            base = baseline[SELECTORS.index(sel)] if baseline else found
+            if found != base:
+                print('{}: select {!r} differs: {} vs {}'.format(
+                    parser, sel, sum(found), sum(base)
+                ))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,46 @@
+'''
+Per-document overhead of ``DataProxy`` and its subclasses over many small
+documents.
+'''
+import sys
+import json
+
+from common import measure, report
+from snagit.core import Contents
+from snagit.lib import DataProxy
+from snagit.lib.lines import Lines, strip
+from snagit.lib.soup import Soup
+
+
+def snippets(count):
+    return [
+        json.dumps({'id': i, 'name': 'item {}'.format(i), 'tags': ['a', 'b']})
+        for i in range(count)
+    ]
+
+
+def main(count=100000):
+    docs = snippets(count)
+    contents, secs, peak = measure(Contents, docs)
+    report('Contents({} snippets)'.format(count), secs, count, peak)
+
+    for name, cls in (('DataProxy', DataProxy), ('Lines', Lines)):
+        proxies, secs, peak = measure(lambda: [cls(d) for d in docs])
+        report('{}(...)'.format(name), secs, count, peak)
+
+        _, secs, peak = measure(lambda: [str(p) for p in proxies])
+        report('str({})'.format(name), secs, count)
+
+    soups = [Soup('<p class="x">{}</p>'.format(i)) for i in range(count // 10)]
+    _, secs, peak = measure(lambda: [s.select('p.x') for s in soups])
+    report('Soup.select', secs, len(soups))
+
+    _, secs, peak = measure(contents, strip, [], {})
+    report('strip command', secs, count, peak)
+
+    _, secs, peak = measure(str, contents)
+    report('str(Contents)', secs, count, peak)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,40 @@
+'''
+Replacing 1,000 literal terms in a large text in a single pass, against
+one ``strutil`` pass per term.
+'''
+import sys
+import random
+
+import strutil
+from common import best_of, report
+from snagit.lib.text import replace_all
+
+LETTERS = 'abcdefghijklmnop'
+
+
+def sequential(text, terms):
+    return strutil.replace_each(text, [(term, '#') for term in terms])
+
+
+def main(size=2 ** 22, count=1000):
+    rand = random.Random(0)
+    vocab = [
+        ''.join(rand.choice(LETTERS) for _ in range(rand.randint(3, 9)))
+        for _ in range(count * 4)
+    ]
+    terms = vocab[:count]
+    words = []
+    length = 0
+    while length < size:
+        words.append(rand.choice(vocab))
+        length += len(words[-1]) + 1
+
+    text = ' '.join(words)
+    elapsed = best_of(sequential, text, terms, repeat=3)
+    report('sequential {} terms'.format(count), elapsed, len(text))
+    elapsed = best_of(replace_all, text, terms, '#', repeat=3)
+    report('single pass {} terms'.format(count), elapsed, len(text))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,34 @@
+'''
+Scaling of ``normalize_tag`` and ``extract_empty`` on wide and deep trees;
+both rewrite the tree in one linear pass, so time should grow with size.
+Documents are released first, as with ``--no-history``, so that the copy
+made by ``Soup`` is not included.
+'''
+import sys
+
+from common import measure, report
+from snagit.lib.soup import Soup, normalize_tag, extract_empty
+
+
+def wide(count):
+    return '<div>{}</div>'.format(''.join(
+        ' text {0} <i></i>\n<b>{0}</b>'.format(i) for i in range(count)
+    ))
+
+
+def deep(count):
+    return '<div> x ' * count + '<i></i>' + '</div>' * count
+
+
+def main(size=4000):
+    for name, make in (('wide', wide), ('deep', deep)):
+        for count in (size // 4, size // 2, size):
+            for cmd in (normalize_tag, extract_empty):
+                soup = Soup(make(count))
+                soup.release()
+                elapsed = measure(cmd, soup, [], {})[1]
+                report('{} {} {}'.format(cmd.__name__, name, count), elapsed)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,39 @@
+'''
+The single pass ``sanitize`` command against the equivalent chain of
+``extract``, ``unwrap`` and ``remove_attrs`` commands.
+'''
+import sys
+
+from common import best_of, report
+from snagit import utils
+from snagit.core import execute_code
+
+ROW = (
+    '<tr bgcolor="#fff" align="left"><td width="10" class="c">'
+    '<font face="x"><center>{0}</center></font></td>'
+    '<td><applet code="a"></applet><u>under</u> <tt>mono</tt></td></tr>'
+)
+
+
+def multi_command_script():
+    tags = utils.get_config('bad_tags')
+    removed = [t for t, r in tags.items() if not r]
+    unwrapped = [t for t, r in tags.items() if r]
+    return '\n'.join([
+        'extract {}'.format(' '.join(removed)),
+        'unwrap {}'.format(' '.join(unwrapped)),
+        'remove_attrs {}'.format(' '.join(utils.get_config('bad_attrs'))),
+    ])
+
+
+def main(rows=2000):
+    page = '<table>{}</table>'.format(
+        ''.join(ROW.format(i) for i in range(rows))
+    )
+    script = multi_command_script()
+    report('multi-command', best_of(execute_code, script, page, repeat=3))
+    report('sanitize', best_of(execute_code, 'sanitize', page, repeat=3))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
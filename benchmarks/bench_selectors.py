@@ -0,0 +1,48 @@
+'''
+Per-document selector overhead: parsing the selector on every call, as
+``BeautifulSoup.select`` did before bs4 4.7, against ``BeautifulSoup.select``
+through soupsieve, and ``Soup.select``, which reuses a cached compiled
+selector.
+'''
+import sys
+
+import soupsieve
+
+from common import best_of, report
+from snagit.lib.soup import Soup
+
+SELECTORS = (
+    'a',
+    'div.item > p',
+    'ul li:nth-child(2n+1) a[href^="/abc"]',
+    'table.results tr td:not(.empty)',
+)
+
+PAGE = '''
+<div class="item"><p>Title {0}</p>
+<ul><li><a href="/abc/{0}">a</a></li><li><a href="/x">b</a></li></ul>
+<table class="results"><tr><td>{0}</td><td class="empty"></td></tr></table>
+</div>
+'''
+
+
+def parse_each(soups, selector):
+    for soup in soups:
+        soupsieve.purge()
+        soupsieve.select(selector, soup._data)
+
+
+def main(count=500):
+    soups = [Soup(PAGE.format(i)) for i in range(count)]
+    for selector in SELECTORS:
+        parsed = best_of(parse_each, soups, selector)
+        raw = best_of(lambda: [s._data.select(selector) for s in soups])
+        cached = best_of(lambda: [s.select(selector) for s in soups])
+        print(selector)
+        report('  parsed per call', parsed, count)
+        report('  BeautifulSoup.select', raw, count)
+        report('  compiled', cached, count)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,43 @@
+'''
+Sorting and counting a large stream of lines within a small memory budget,
+against sorting the same lines in memory.
+'''
+import os
+import sys
+import tempfile
+
+from common import measure, report
+from snagit.core import Interpreter
+
+
+def run(filename, script):
+    interp = Interpreter(history=False)
+    interp.execute('load {} stream=True\n{}'.format(filename, script))
+    with open(os.devnull, 'w') as fp:
+        interp.contents.write(fp)
+
+
+def main(count=1000000, memory=2 ** 22):
+    fd, filename = tempfile.mkstemp(suffix='.log')
+    with os.fdopen(fd, 'w') as fp:
+        for i in range(count):
+            fp.write('host{} {}\n'.format(i * 7919 % 5000, i * 104729 % count))
+
+    scripts = [
+        'sort memory=1000000000',
+        'sort memory={}'.format(memory),
+        'sort key=2 numeric=True memory={}'.format(memory),
+        'count memory={}'.format(memory),
+        'dedupe',
+        'dedupe approximate=True capacity={}'.format(count),
+    ]
+    try:
+        for script in scripts:
+            result, elapsed, peak = measure(run, filename, script)
+            report(script, elapsed, count, peak)
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,40 @@
+'''
+Filtering a large log file loaded into memory, against streaming it
+through the same line commands with ``load stream=True``.
+'''
+import os
+import sys
+import tempfile
+
+from common import measure, report
+from snagit.core import Interpreter
+
+SCRIPT = 'matches ERROR\nstrip\nformat "{1}: {0}"'
+
+
+def run(filename, stream):
+    interp = Interpreter(history=False)
+    interp.execute('load {} stream={}\n{}'.format(filename, stream, SCRIPT))
+    with open(os.devnull, 'w') as fp:
+        interp.contents.write(fp)
+
+
+def main(count=1000000):
+    fd, filename = tempfile.mkstemp(suffix='.log')
+    with os.fdopen(fd, 'w') as fp:
+        for i in range(count):
+            fp.write('  {} request {}\n'.format(
+                'ERROR' if i % 97 == 0 else 'INFO', i
+            ))
+
+    try:
+        for stream in (False, True):
+            result, elapsed, peak = measure(run, filename, stream)
+            name = 'stream={} {} lines'.format(stream, count)
+            report(name, elapsed, count, peak)
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,38 @@
+'''
+Cleaning a large text dump with replace_each and compress_text loaded into
+memory, against streaming it through the same commands.
+'''
+import os
+import sys
+import tempfile
+
+from common import measure, report
+from snagit.core import Interpreter
+
+SCRIPT = 'replace_each _ foo bar r"id=\\d+"\ncompress_text'
+
+
+def run(filename, stream):
+    interp = Interpreter(history=False)
+    interp.execute('load {} stream={}\n{}'.format(filename, stream, SCRIPT))
+    with open(os.devnull, 'w') as fp:
+        interp.contents.write(fp)
+
+
+def main(count=500000):
+    fd, filename = tempfile.mkstemp(suffix='.txt')
+    with os.fdopen(fd, 'w') as fp:
+        for i in range(count):
+            fp.write('  foo\t id={}   bar baz  \n\n'.format(i))
+
+    try:
+        for stream in (False, True):
+            result, elapsed, peak = measure(run, filename, stream)
+            name = 'stream={} {} lines'.format(stream, count)
+            report(name, elapsed, count, peak)
+    finally:
+        os.remove(filename)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,35 @@
+'''
+Extraction from many pages with ``Soup`` documents against lxml backed
+``Tree`` documents.
+'''
+import sys
+
+from common import measure, report
+from snagit.core import Interpreter
+
+PAGE = '<html><body><div class="item">{}</div></body></html>'.format(''.join(
+    '<p class="c">para <a href="/x/{0}">{0}</a></p>'.format(i)
+    for i in range(200)
+))
+
+SCRIPTS = (
+    ('soup', 'parse\nselect "p.c a"\nmerge'),
+    ('tree', 'tree\ncss "p.c a"\nmerge'),
+    ('tree text', 'tree\ncss "p.c a"\ntext'),
+)
+
+
+def run(pages, script):
+    interp = Interpreter([PAGE] * pages, history=False)
+    interp.execute(script)
+    return interp
+
+
+def main(pages=200):
+    for name, script in SCRIPTS:
+        result, elapsed, peak = measure(run, pages, script)
+        report('{} {} pages'.format(name, pages), elapsed, pages, peak)
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:]])
@@ -0,0 +1,51 @@
+'''
+Shared helpers for the benchmark scripts.
+
+Each ``bench_*.py`` script is run directly from the repository root::
+
+    $ python benchmarks/bench_proxy.py
+'''
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure(func, *args, **kws):
+    '''
+    Call ``func`` once, returning ``(result, seconds, peak_bytes)``.
+    '''
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func(*args, **kws)
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def best_of(func, *args, repeat=5, **kws):
+    '''
+    Return the fastest of ``repeat`` timings of ``func``, in seconds.
+    '''
+    best = None
+    for i in range(repeat):
+        start = time.perf_counter()
+        func(*args, **kws)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best
+
+
+def report(name, seconds, count=None, peak=None):
+    line = '{:<48} {:>10.4f}s'.format(name, seconds)
+    if count:
+        line += ' {:>10.2f}us/item'.format(seconds / count * 1e6)
+
+    if peak is not None:
+        line += ' {:>10.1f}KiB peak'.format(peak / 1024)
+
+    print(line)
@@ -29,7 +29,7 @@ setup(
         'Programming Language :: Python :: 2.7',
     ),
     packages=find_packages(),
-    install_requires=['requests', 'beautifulsoup4', 'strutil'],
+    install_requires=['requests', 'beautifulsoup4>=4.7', 'strutil'],
     entry_points = {
         'console_scripts': ['snagit = snagit.__main__:main']
     }
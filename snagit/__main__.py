@@ -48,10 +48,43 @@ def parse_args(args=None):
         '-o', '--output',
         help='output result to specified file'
     )
+    parser.add_argument(
+        '--append', action='store_true',
+        help='append to the output file rather than replacing it'
+    )
+    parser.add_argument(
+        '--gzip', action='store_true', default=None,
+        help='gzip compress the output file (default for .gz filenames)'
+    )
+    parser.add_argument(
+        '--rotate-size', dest='rotate_size',
+        help='start a new numbered output file after this size (e.g. 100M)'
+    )
+    parser.add_argument(
+        '--rotate-count', dest='rotate_count', type=int,
+        help='start a new numbered output file after this many documents'
+    )
     parser.add_argument(
         '-i', '--repl', action='store_true',
         help='Enter interactive (REPL) script mode (default if script(s) are given)'  # noqa
     )
+    parser.add_argument(
+        '--max-memory', dest='max_memory',
+        help='spill documents to a temporary file once their estimated text '
+             'size exceeds this (e.g. 2G)'
+    )
+    parser.add_argument(
+        '--no-history', dest='history', action='store_false',
+        help='do not keep previous contents for "end"; avoids copying'
+    )
+    parser.add_argument(
+        '--raw', action='store_true',
+        help='output soup as plain markup, without pretty formatting'
+    )
+    parser.add_argument(
+        '--parser',
+        help='HTML parser: lxml, html5lib, html.parser (default) or auto'
+    )
     parser.add_argument('--exec', help='execute statements')
 
     return parser, parser.parse_args(args)
@@ -76,30 +109,45 @@ def run_program(prog_args=None):
         print('{} - v{}'.format(parser.prog, get_version()))
         sys.exit(0)
 
-    output = ''
+    if args.parser:
+        utils.set_config(parser=args.parser)
+
     loader = Loader(use_cache=args.cache)
     sources = utils.expand_range_set(args.source, args.range_set)
     contents = loader.load_sources(sources) if sources else ''
 
-    prog = repl.Repl(contents, loader, do_pm=args.pm)
+    prog = repl.Repl(
+        contents,
+        loader,
+        do_pm=args.pm,
+        max_memory=args.max_memory,
+        history=args.history
+    )
+    output = utils.LazyFile(
+        args.output,
+        compress=args.gzip,
+        append=args.append,
+        rotate_size=args.rotate_size,
+        rotate_count=args.rotate_count
+    )
     for script in args.script:
         code = utils.read_file(script)
-        output += str(prog.execute(code))
+        prog.execute(code).write(output, raw=args.raw)
 
     if args.exec:
-        output += str(prog.execute(args.exec))
+        prog.execute(args.exec).write(output, raw=args.raw)
 
     if args.repl or not (args.script or args.exec):
-        output += str(prog.repl(print_all=args.print))
+        prog.repl(print_all=args.print).write(output, raw=args.raw)
 
-    if output:
-        logger.debug('Writing {} chars'.format(len(output)))
+    if output.count:
+        logger.debug('Wrote {} chars'.format(output.count))
         if args.output:
-            utils.write_file(args.output, output)
-            logger.debug('Saved to {}'.format(args.output))
+            logger.debug('Saved to {}'.format(', '.join(output.filenames)))
         else:
-            print(output)
+            print()
 
+    output.close()
     logger.debug('Completed in {} seconds'.format(datetime.now() - start))
     return contents
 
@@ -9,6 +9,7 @@ import functools
 import importlib
 from pprint import pformat
 from collections import namedtuple
+from itertools import groupby
 from traceback import format_tb
 from requests.exceptions import RequestException
 
@@ -16,12 +17,21 @@ import strutil
 from cachely.loader import Loader
 
 from .lib import library, interpreter_library, DataProxy
+from .lib.lines import LineStream
+from .lib.records import Records
 from . import utils
 from . import core
 from . import exceptions
+from .store import SpillStore, Spilled
 
 logger = logging.getLogger(__name__)
-BASE_LIBS = ['snagit.lib.text', 'snagit.lib.lines', 'snagit.lib.soup']
+BASE_LIBS = [
+    'snagit.lib.text',
+    'snagit.lib.lines',
+    'snagit.lib.soup',
+    'snagit.lib.tree',
+    'snagit.lib.jsondata',
+]
 ReType = type(re.compile(''))
 
 
@@ -35,17 +45,19 @@ class Instruction(namedtuple('Instruction', 'cmd args kws line lineno')):
     digit, True, False, None, or a simple, unquoted string.
     '''
     values_pat = r'''
-        [rj]?'(?:(\'|[^'])*?)' |
-        [r]?"(?:(\"|[^"])*?)"  |
-        (\d+)                  |
-        (True|False|None)      |
-        ([^\s,]+)
+        [rj]?'[^']*'    |
+        r?"[^"]*"       |
+        \d+             |
+        True|False|None |
+        [^\s,]+
     '''
 
+    # Matched at each position in turn, rather than searched for and sliced
+    # off the front of the remaining text
     args_re = re.compile(
-        r'''^(
+        r'''(?:
             (?P<kwd>\w[\w\d-]*)=(?P<val>{0}) |
-            (?P<arg>{0}|([\s,]+))
+            (?P<arg>{0}|[\s,]+)
         )\s*'''.format(values_pat),
         re.VERBOSE
     )
@@ -91,25 +103,27 @@ class Instruction(namedtuple('Instruction', 'cmd args kws line lineno')):
         cmd, text = strutil.splitter(line, expected=2, strip=True)
         cmd = cmd.lower()
 
-        while text:
-            m = cls.args_re.search(text)
+        pos = 0
+        end = len(text)
+        match = cls.args_re.match
+        while pos < end:
+            m = match(text, pos)
             if not m:
                 break
 
-            gdict = m.groupdict()
-            kwd = gdict.get('kwd')
+            kwd = m.group('kwd')
             if kwd:
-                kws[kwd] = cls.get_value(gdict.get('val', ''))
+                kws[kwd] = cls.get_value(m.group('val'))
             else:
-                arg = gdict.get('arg', '').strip()
+                arg = m.group('arg').strip()
                 if arg != ',':
                     args.append(cls.get_value(arg))
 
-            text = text[len(m.group()):]
+            pos = m.end()
 
-        if text:
+        if pos < end:
             raise SyntaxError(
-                'Syntax error: "{}" (line {})'.format(text, lineno)
+                'Syntax error: "{}" (line {})'.format(text[pos:], lineno)
             )
 
         return cls(cmd, args, kws, line, lineno)
@@ -148,11 +162,17 @@ class Interpreter:
         loader=None,
         use_cache=False,
         do_pm=False,
-        extensions=None
+        extensions=None,
+        max_memory=None,
+        history=True
     ):
         self.use_cache = use_cache
         self.loader = loader if loader else Loader(use_cache=use_cache)
-        self.contents = Contents(contents)
+        self.contents = Contents(
+            contents,
+            max_memory=max_memory,
+            history=history
+        )
         self.do_debug = False
         self.do_pm = do_pm
         self.instructions = []
@@ -165,6 +185,13 @@ class Interpreter:
             ct.decode() if isinstance(ct, bytes) else ct for ct in contents
         ])
 
+    def stream_sources(self, sources):
+        '''
+        Set the contents to line streams over ``sources``, which are only
+        read as commands consume them, bypassing the cache.
+        '''
+        self.contents.update([LineStream.open(src) for src in sources])
+
     def listing(self, linenos=False):
         items = []
         for instr in self.instructions:
@@ -237,14 +264,48 @@ def execute_code(code, contents=''):
     return str(intrep.execute(code))
 
 
+def _merge_records(documents):
+    for is_records, group in groupby(
+        documents,
+        lambda data: isinstance(data, Records)
+    ):
+        if is_records:
+            yield Records.merge(group)
+        else:
+            yield from group
+
+
 class Contents:
+    '''
+    The list of current documents, plus a stack of previous snapshots.
 
-    def __init__(self, contents=None):
+    If ``max_memory`` is given, documents beyond that budget are spilled to a
+    temporary ``SpillStore``, oldest snapshots first, and are loaded back
+    transparently when iterated. The budget is compared with the documents'
+    estimated text sizes, as given by ``DataProxy.size``, not with the memory
+    they actually use.
+
+    Without ``history``, no snapshots are kept, and documents are released
+    to each command so that their data can be reused rather than copied.
+
+    A ``parser``, as set by the ``parser`` command, is passed to each soup
+    command as its ``parser`` keyword, unless the command gives one itself.
+    '''
+
+    def __init__(self, contents=None, max_memory=None, history=True):
         self.stack = []
+        self.history = history
+        self.parser = None
+        self.max_memory = utils.parse_size(max_memory) if max_memory else None
+        self.store = None
+        self.resident = 0
         self.set_contents(contents)
 
     def __iter__(self):
-        return iter(self.contents)
+        if self.store is None:
+            return iter(self.contents)
+
+        return (self.store.load(ct) for ct in self.contents)
 
     def __len__(self):
         return len(self.contents)
@@ -252,30 +313,73 @@ class Contents:
     def __str__(self):
         return '\n'.join(str(c) for c in self)
 
+    def write(self, fp, **kws):
+        '''
+        Write each document to the file-like ``fp`` in turn, separated by
+        newlines, without joining them into a single string. A ``LazyFile``
+        is told where each document starts, so that it can rotate files,
+        and gives the separator, so that appended output is separated too.
+
+        With ``format='csv'``, consecutive records documents are merged, so
+        that they are written as a single table with one header.
+        '''
+        documents = iter(self)
+        if kws.get('format') == 'csv':
+            documents = _merge_records(documents)
+
+        sep = ''
+        next_document = getattr(fp, 'next_document', None)
+        for data in documents:
+            if next_document:
+                sep = next_document()
+
+            fp.write(sep)
+            data.write(fp, **kws)
+            sep = '\n'
+
     # def __getitem__(self, index):
     #     return self.contents[index]
 
     def pop(self):
         if self.stack:
+            self._uncount(self.contents)
             self.contents = self.stack.pop()
 
+    def release(self):
+        if not self.history:
+            for data in self.contents:
+                if not isinstance(data, Spilled):
+                    data.release()
+
     def __call__(self, func, args, kws):
-        contents = []
-        for data in self:
-            result = func(data, args, kws)
-            contents.append(result)
+        self.release()
+        is_soup = getattr(func, 'kind', None) == 'Soup'
+        if self.parser and is_soup and 'parser' not in kws:
+            kws = dict(kws, parser=self.parser)
+
+        if getattr(func, 'batch', False):
+            contents = func(iter(self), args, kws)
+        else:
+            contents = []
+            for data in self:
+                result = func(data, args, kws)
+                contents.append(result)
 
         self.update(contents)
 
     def merge(self):
         if self.contents:
-            first = self.contents[0]
-            data = first.merge(self.contents)
+            self.release()
+            first = next(iter(self))
+            data = first.merge(self)
             self.update([data])
 
     def update(self, contents):
         if self.contents:
-            self.stack.append(self.contents)
+            if self.history:
+                self.stack.append(self.contents)
+            else:
+                self._uncount(self.contents)
 
         self.set_contents(contents)
 
@@ -289,5 +393,35 @@ class Contents:
         for ct in contents:
             if isinstance(ct, (str, bytes)):
                 ct = DataProxy(ct)
-            
+
             self.contents.append(ct)
+
+        if self.max_memory:
+            self.resident += sum(ct.size() for ct in self.contents)
+            self._spill()
+
+    def _uncount(self, items):
+        if self.max_memory:
+            self.resident -= sum(
+                ct.size() for ct in items if not isinstance(ct, Spilled)
+            )
+
+    def _spill(self):
+        if self.resident <= self.max_memory:
+            return
+
+        if self.store is None:
+            self.store = SpillStore()
+
+        for items in self.stack + [self.contents]:
+            for i, ct in enumerate(items):
+                if self.resident <= self.max_memory:
+                    return
+
+                if not isinstance(ct, Spilled):
+                    size = ct.size()
+                    if size:
+                        items[i] = self.store.spill(ct)
+                        self.resident -= size
+
+        logger.debug('Spilled {} bytes to disk'.format(self.store.size))
@@ -1,3 +1,4 @@
+import sys
 import requests
 from urllib3.exceptions import HTTPError
 
@@ -6,6 +7,13 @@ from ..exceptions import SnarfQuit
 
 
 class DataProxy:
+    '''
+    Base document type. Subclasses declare ``__slots__`` and provide
+    explicit accessors for the methods commands need, rather than
+    delegating attribute lookup to the wrapped data.
+    '''
+
+    __slots__ = ('_data',)
 
     def __init__(self, data):
         self._data = data.decode() if isinstance(data, bytes) else data
@@ -19,8 +27,31 @@ class DataProxy:
     def __len__(self):
         return len(self._data)
 
-    def __getattr__(self, attr):
-        return getattr(self._data, attr)
+    def __reduce__(self):
+        return (self.__class__, (self._data,))
+
+    def release(self):
+        '''
+        Mark the document as no longer needed once the current command
+        finishes, allowing the command to reuse its data rather than copy it.
+        '''
+
+    def write(self, fp, **kws):
+        '''
+        Write the text representation to the file-like ``fp``.
+        '''
+        fp.write(str(self))
+
+    def size(self):
+        '''
+        Approximate size, as the length of the text representation. This is
+        an estimate for the spill budget rather than a measure of memory, and
+        subclasses provide cheaper ones where rendering is costly.
+        '''
+        if isinstance(self._data, (str, bytes)):
+            return len(self._data)
+
+        return len(str(self))
 
     @classmethod
     def merge(cls, all_data):
@@ -28,13 +59,23 @@ class DataProxy:
 
 
 class Library:
+    '''
+    Registry of commands.
+
+    By default, a command is called once per document as
+    ``func(data, args, kws)`` and returns the new document. Registering with
+    ``batch=True`` declares that the command instead accepts an iterable of
+    all documents, as ``func(all_data, args, kws)``, and returns the list of
+    new documents, allowing any setup to be done once per instruction.
+    '''
 
     def __init__(self):
         self.registry = {}
 
-    def register(self, kind):
+    def register(self, kind, batch=False):
         def register(func):
             func.kind = kind
+            func.batch = batch
             name = func.__name__.rstrip('_')
             self.registry[name] = func
             return func
@@ -94,6 +135,24 @@ def merge(interp, args, kws):
     interp.contents.merge()
 
 
+@register
+def parser(interp, args, kws):
+    '''
+    Set the HTML parser used for all following soup commands of this
+    script. One of ``lxml``, ``html5lib``, ``html.parser`` or ``auto``.
+    '''
+    interp.contents.parser = args[0] if args else 'auto'
+
+
+@register
+def history(interp, args, kws):
+    '''
+    Turn keeping previous contents for ``end`` on (the default) or off.
+    Without history, commands can reuse documents instead of copying them.
+    '''
+    interp.contents.history = args[0] if args else True
+
+
 @register
 def cache(interp, args, kws):
     '''
@@ -105,10 +164,15 @@ def cache(interp, args, kws):
 @register
 def load(interp, args, kws):
     '''
-    Load new resource(s).
+    Load new resource(s). With ``stream=True``, each resource is read line by
+    line as it is used, rather than loaded into memory.
     '''
     range_set = kws.get('range_set', kws.get('range'))
     sources = utils.expand_range_set(args, range_set)
+    if kws.get('stream'):
+        interp.stream_sources(sources)
+        return
+
     try:
         contents = interp.load_sources(sources)
     except (requests.RequestException, HTTPError) as exc:
@@ -150,9 +214,31 @@ def run(interp, args, kws):
 @register
 def write(interp, args, kws):
     '''
-    Dumps the text representation of all content to the specified file.
-    '''
-    utils.write_file(args[0], str(interp.contents))
+    Dumps the text representation of all content to the specified file,
+    streaming one document at a time. With ``raw=True``, soup is written as
+    plain markup rather than pretty formatted.
+
+    The output is gzip compressed with ``gzip=True`` or a ``.gz`` filename,
+    appended with ``append=True``, and rotated to numbered files after
+    ``rotate_size`` characters or ``rotate_count`` documents. Unless
+    appending, the file is truncated even when there is nothing to write.
+    Sizes with units must be quoted, as in ``rotate_size='100M'``.
+    '''
+    utils.check_args('write', args, 1)
+    kws = dict(kws)
+    append = kws.pop('append', False)
+    sink = utils.LazyFile(
+        args[0],
+        compress=kws.pop('gzip', None),
+        append=append,
+        rotate_size=kws.pop('rotate_size', None),
+        rotate_count=kws.pop('rotate_count', None)
+    )
+    with sink as fp:
+        if not append:
+            fp.open()
+
+        interp.contents.write(fp, **kws)
 
 
 @register
@@ -160,7 +246,8 @@ def print_(interp, args, kws):
     '''
     Print out the text representation of the content.
     '''
-    print(str(interp.contents))
+    interp.contents.write(sys.stdout, **kws)
+    print()
 
 
 @register
@@ -0,0 +1,303 @@
+'''
+Document type for decoded JSON values, with path queries.
+
+A path is a dotted list of keys, where integers index arrays and ``*``
+matches every key or item, as in ``results.*.name`` or ``items.0``.
+'''
+import re
+import json
+import logging
+import functools
+
+from . import DataProxy, library
+from .records import Records
+from .. import utils
+
+logger = logging.getLogger(__name__)
+register = library.register('Json')
+space_re = re.compile(r'\s*')
+separator_re = re.compile(r'[\s,]*')
+WILDCARD = '*'
+
+
+class Json(DataProxy):
+    '''
+    Handler for a decoded JSON value. Text is decoded, and other values
+    used as is; ``wrap`` takes any decoded value, including strings.
+    '''
+
+    __slots__ = ()
+
+    def __init__(self, data):
+        if isinstance(data, Json):
+            data = data._data
+        elif isinstance(data, Records):
+            data = list(data._data)
+        elif isinstance(data, bytes):
+            data = json.loads(data.decode())
+        elif isinstance(data, (str, DataProxy)):
+            data = json.loads(str(data))
+
+        self._data = data
+
+    @classmethod
+    def wrap(cls, value):
+        '''
+        Create a ``Json`` from an already decoded value, without parsing it.
+        '''
+        self = cls.__new__(cls)
+        self._data = value
+        return self
+
+    def __reduce__(self):
+        return (self.__class__.wrap, (self._data,))
+
+    def __str__(self):
+        return json.dumps(self._data, ensure_ascii=False)
+
+    def __iter__(self):
+        data = self._data
+        return iter(data if isinstance(data, list) else [data])
+
+    def __len__(self):
+        data = self._data
+        return len(data) if isinstance(data, list) else 1
+
+    def write(self, fp, indent=None, **kws):
+        json.dump(self._data, fp, ensure_ascii=False, indent=indent)
+
+    def query(self, path):
+        return list(query(self._data, path))
+
+    @classmethod
+    def merge(cls, all_data):
+        results = []
+        for data in all_data:
+            results.extend(data)
+
+        return cls.wrap(results)
+
+
+@functools.lru_cache(maxsize=256)
+def parse_path(path):
+    '''
+    Split ``path`` into a tuple of keys, integer indexes and wildcards.
+    '''
+    path = '' if path is None else str(path)
+    keys = []
+    for key in path.split('.') if path else []:
+        if not key:
+            raise ValueError('Invalid path: {}'.format(path))
+
+        keys.append(int(key) if key.lstrip('-').isdigit() else key)
+
+    return tuple(keys)
+
+
+def query(value, path):
+    '''
+    Yield each value found at ``path`` within ``value``.
+    '''
+    values = [value]
+    for key in parse_path(path):
+        found = []
+        for value in values:
+            if key == WILDCARD:
+                if isinstance(value, dict):
+                    found.extend(value.values())
+                elif isinstance(value, list):
+                    found.extend(value)
+            elif isinstance(value, dict):
+                if str(key) in value:
+                    found.append(value[str(key)])
+            elif isinstance(value, list) and isinstance(key, int):
+                if -len(value) <= key < len(value):
+                    found.append(value[key])
+
+        values = found
+
+    return iter(values)
+
+
+def get(value, path, default=None):
+    return next(query(value, path), default)
+
+
+def is_projection(path):
+    return WILDCARD in parse_path(path)
+
+
+def iter_values(chunks):
+    '''
+    Incrementally decode a stream of JSON text, given as an iterable of
+    chunks. The items of a top level array are yielded one at a time, as
+    is each value of a sequence of values such as JSON lines. Only the
+    undecoded remainder of the stream is kept in memory.
+    '''
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buf = ''
+    pos = 0
+    want = 0
+    eof = False
+    in_array = None
+    while True:
+        if want:
+            # Read until the buffer doubles, so that a value spanning many
+            # chunks is not decoded again for each one
+            buf = buf[pos:]
+            pos = 0
+            while len(buf) < want:
+                chunk = next(chunks, None)
+                if chunk is None:
+                    eof = True
+                    break
+
+                buf += chunk
+
+            want = 0
+
+        pos = (separator_re if in_array else space_re).match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                if in_array:
+                    raise ValueError('Unterminated JSON array')
+                return
+
+            want = 1
+            continue
+
+        if in_array is None:
+            in_array = buf[pos] == '['
+            pos += in_array
+            continue
+
+        if in_array and buf[pos] == ']':
+            return
+
+        try:
+            value, end = decoder.raw_decode(buf, pos)
+        except ValueError:
+            if eof:
+                raise
+
+            want = 2 * (len(buf) - pos)
+            continue
+
+        # A number ending the buffer, or cut before its fraction or exponent,
+        # may continue in the next chunk
+        if not eof and (end == len(buf) or buf[end] in '.eE'):
+            want = 2 * (len(buf) - pos)
+            continue
+
+        yield value
+        pos = end
+
+
+def flatten_value(value, prefix='', record=None):
+    '''
+    Flatten nested objects and arrays into a single dict, with dotted paths
+    for keys.
+    '''
+    record = {} if record is None else record
+    if isinstance(value, dict) and value:
+        items = value.items()
+    elif isinstance(value, list) and value:
+        items = enumerate(value)
+    else:
+        record[prefix or 'value'] = value
+        return record
+
+    for key, item in items:
+        key = '{}.{}'.format(prefix, key) if prefix else str(key)
+        flatten_value(item, key, record)
+
+    return record
+
+
+@library.register('Json', batch=True)
+def json_(all_data, args, kws):
+    '''
+    Decode each document as JSON, or use the given value, such as a ``j'...'``
+    literal. With ``stream=True``, the items of a top level array, or a
+    sequence of values such as JSON lines, are decoded incrementally, each
+    as a separate document.
+    '''
+    if args:
+        yield Json.wrap(args[0])
+        return
+
+    for data in all_data:
+        if kws.get('stream'):
+            for value in iter_values(utils.iter_chunks(data)):
+                yield Json.wrap(value)
+        else:
+            yield data if isinstance(data, Json) else Json(data)
+
+
+@register
+def query_(data, args, kws):
+    '''
+    Select the value at a path. A path containing a ``*`` wildcard selects
+    a list of all values found.
+    '''
+    data = Json(data)
+    path = args[0] if args else ''
+    if is_projection(path):
+        return Json.wrap(data.query(path))
+
+    return Json.wrap(get(data._data, path, kws.get('default')))
+
+
+@register
+def pluck(data, args, kws):
+    '''
+    Select the value at each path from every item of a list: a list of
+    values for a single path, or of objects keyed by path for several.
+    '''
+    data = Json(data)
+    if len(args) == 1:
+        return Json.wrap([get(item, args[0]) for item in data])
+
+    return Json.wrap([
+        {path: get(item, path) for path in args} for item in data
+    ])
+
+
+def _matches(item, args, kws):
+    for path in args:
+        if not get(item, path):
+            return False
+
+    for path, expected in kws.items():
+        value = get(item, path.replace('__', '.'))
+        if utils.is_regex(expected):
+            if value is None or not expected.search(str(value)):
+                return False
+        elif value != expected:
+            return False
+
+    return True
+
+
+@register
+def filter_(data, args, kws):
+    '''
+    Keep the items of a list for which each path argument has a true value,
+    and each keyword path, with ``__`` for ``.``, equals the given value or
+    matches the given regex.
+    '''
+    return Json.wrap([
+        item for item in Json(data) if _matches(item, args, kws)
+    ])
+
+
+@register
+def flatten(data, args, kws):
+    '''
+    Convert the items of a list, or the values at the optional path, into
+    records, joining nested keys with ``.``.
+    '''
+    data = Json(data)
+    items = data.query(args[0]) if args else list(data)
+    return Records(flatten_value(item) for item in items)
@@ -1,113 +1,683 @@
 # -*- coding:utf8 -*-
 import re
 import os
+import mmap
 import logging
+from array import array
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from itertools import accumulate, chain, groupby, islice
+from operator import add
 from pprint import pformat
 
 import strutil
 from . import DataProxy, library
+from .. import utils
+from ..store import external_sort
 
 logger = logging.getLogger(__name__)
-register = library.register('Lines')
+register = library.register('Lines', batch=True)
+number_re = re.compile(r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)')
+digits_re = re.compile(r'(\d+)')
 
 
 def is_lines(what):
     return isinstance(what, (list, tuple))
 
 
+def _offsets(values=()):
+    return memoryview(array('q', values))
+
+
+def index_lines(text, block=2 ** 20):
+    '''
+    Return arrays of the start and end offsets of each line of ``text``, as
+    split by ``str.splitlines``. The text is split a block at a time, so
+    that only one block's worth of line strings exists at once.
+    '''
+    starts = array('q')
+    ends = array('q')
+    pos = 0
+    while pos < len(text):
+        cut = text.find('\n', pos + block)
+        end = len(text) if cut < 0 else cut + 1
+        chunk = text[pos:end]
+        chunk_starts = list(accumulate(chain(
+            [pos],
+            map(len, chunk.splitlines(True))
+        )))[:-1]
+        starts.extend(chunk_starts)
+        ends.extend(map(add, chunk_starts, map(len, chunk.splitlines())))
+        pos = end
+
+    return memoryview(starts), memoryview(ends)
+
+
+def _join_lines(lines):
+    '''
+    Return a buffer and offsets for a list of lines, which are kept intact
+    even if they contain line breaks.
+    '''
+    lengths = list(map(len, lines))
+    starts = list(accumulate(chain([0], [n + 1 for n in lengths])))[:-1]
+    return (
+        '\n'.join(lines),
+        _offsets(starts),
+        _offsets(map(add, starts, lengths))
+    )
+
+
 def _prepare_lines(data):
-    if is_lines(data):
-        return list(data)
-    elif isinstance(data, Lines):
-        return data._data[:]
+    if isinstance(data, Lines):
+        return data
 
-    return str(data).splitlines()
+    return Lines(data)
 
 
 class Lines(DataProxy):
     '''
     Handler class for manipulating and traversing lines of text.
+
+    The lines are kept as a single text buffer plus arrays of the start
+    and end offset of each line, so that slicing or filtering the lines
+    creates new offsets over the same buffer rather than new strings.
     '''
 
-    def __init__(self, data):
-        super().__init__(_prepare_lines(data))
+    __slots__ = ('_starts', '_ends')
+
+    def __init__(self, data, starts=None, ends=None):
+        if starts is not None:
+            self._data, self._starts, self._ends = data, starts, ends
+        elif isinstance(data, Lines):
+            self._data = data._data
+            self._starts = data._starts
+            self._ends = data._ends
+        elif is_lines(data) or isinstance(data, LineStream):
+            self._data, self._starts, self._ends = _join_lines(list(data))
+        else:
+            super().__init__(str(data) if isinstance(data, DataProxy) else data)
+            self._starts, self._ends = index_lines(self._data)
 
     def __str__(self):
-        return '\n'.join(self._data)
+        return '\n'.join(self)
+
+    def __iter__(self):
+        buf = self._data
+        for start, end in zip(self._starts, self._ends):
+            yield buf[start:end]
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Lines(self._data, self._starts[index], self._ends[index])
+
+        return self._data[self._starts[index]:self._ends[index]]
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+    def size(self):
+        return len(self._data) + 16 * len(self)
+
+    def subset(self, indexes):
+        '''
+        Return the lines at ``indexes``, in order, over the same buffer.
+        '''
+        indexes = list(indexes)
+        starts = self._starts
+        ends = self._ends
+        return Lines(
+            self._data,
+            _offsets(starts[i] for i in indexes),
+            _offsets(ends[i] for i in indexes)
+        )
+
+    def find(self, what, start=0):
+        '''
+        Return the index of the first line from ``start`` matching ``what``,
+        a string or a ``utils.Matcher``, or ``None``. Strings, and matchers
+        of only strings, search the buffer as a whole rather than each line
+        in turn.
+        '''
+        if isinstance(what, utils.Matcher):
+            if what.string is not None:
+                what = what.string
+            elif what.searchable:
+                what = what.strings_re
+            else:
+                for i in range(start, len(self)):
+                    if what(self[i]):
+                        return i
+
+                return None
+
+        buf = self._data
+        starts = self._starts
+        ends = self._ends
+        if start >= len(starts):
+            return None
+
+        is_string = strutil.is_string(what)
+        pos = starts[start]
+        stop = ends[-1]
+        while True:
+            if is_string:
+                pos = buf.find(what, pos, stop)
+                end = pos + len(what)
+            else:
+                m = what.search(buf, pos, stop)
+                pos, end = (m.start(), m.end()) if m else (-1, 0)
+
+            if pos < 0:
+                return None
+
+            i = bisect_right(starts, pos, start) - 1
+            if end <= ends[i]:
+                return i
+
+            # A match may run past the end of the line: a regex may still
+            # match within it, while a string would run past it again
+            if not is_string and pos < ends[i]:
+                if what.search(buf, pos, ends[i]):
+                    return i
+
+            if i + 1 == len(starts):
+                return None
+
+            pos = starts[i + 1]
+
+    def iter_matches(self, what):
+        '''
+        Yield the index of each line matching ``what``: a ``utils.Matcher``,
+        or a single pattern as for ``strutil.matches``.
+        '''
+        if not isinstance(what, utils.Matcher):
+            what = utils.Matcher([what])
+
+        if what.string is None and not what.searchable:
+            for i, line in enumerate(self):
+                if what(line):
+                    yield i
+        else:
+            i = self.find(what)
+            while i is not None:
+                yield i
+                i = self.find(what, i + 1)
+
+    def write(self, fp, **kws):
+        sep = ''
+        for line in self:
+            fp.write(sep + line)
+            sep = '\n'
 
     @classmethod
     def merge(cls, all_data):
         data = []
         for lines in all_data:
-            data += lines._data
+            data.extend(_prepare_lines(lines))
 
         return cls(data)
 
 
+class LineStream(DataProxy):
+    '''
+    Lazily produced lines, for sources larger than memory. The data is a
+    picklable factory, called each time the lines are iterated, so that
+    line commands chain into a pipeline over the source that runs only as
+    the lines are written. Use the ``lines`` command to read them into
+    ``Lines``.
+    '''
+
+    __slots__ = ()
+
+    @classmethod
+    def open(cls, source):
+        '''
+        Stream the lines of a file or URL ``source``.
+        '''
+        return cls(partial(utils.iter_source_lines, source))
+
+    def filename(self):
+        '''
+        The local file this stream reads directly, if any.
+        '''
+        func = self._data
+        if isinstance(func, partial) and func.func is utils.iter_source_lines:
+            return utils.local_filename(func.args[0])
+
+    def pipe(self, step, *args):
+        '''
+        Return a new stream of ``step(self, *args)``.
+        '''
+        return LineStream(partial(step, self, *args))
+
+    def __str__(self):
+        return '\n'.join(self)
+
+    def __iter__(self):
+        return iter(self._data())
+
+    def __len__(self):
+        return sum(1 for line in self)
+
+    def size(self):
+        return 0
+
+    def iter_chunks(self, size=2 ** 16):
+        chunk = []
+        length = 0
+        for line in self:
+            chunk.append(line)
+            length += len(line) + 1
+            if length >= size:
+                chunk.append('')
+                yield '\n'.join(chunk)
+                chunk = []
+                length = 0
+
+        if chunk:
+            yield '\n'.join(chunk)
+
+    def write(self, fp, **kws):
+        sep = ''
+        for line in self:
+            fp.write(sep + line)
+            sep = '\n'
+
+    @classmethod
+    def merge(cls, all_data):
+        return cls(partial(chain.from_iterable, list(all_data)))
+
+
+def _format_lines(lines, fmt):
+    fmt = fmt.format
+    for lineno, line in enumerate(lines, 1):
+        yield fmt(line, lineno)
+
+
+def _strip_lines(lines):
+    for line in lines:
+        yield line.strip()
+
+
+def _skip_lines(lines, matcher, keep):
+    found = next(
+        (i for i, line in enumerate(lines) if matcher(line)),
+        None
+    )
+    if found is not None and not keep:
+        found += 1
+
+    return islice(lines, found or 0, None)
+
+
+def _read_lines(lines, matcher, keep):
+    for line in lines:
+        if matcher(line):
+            if keep:
+                yield line
+            return
+
+        yield line
+
+
+def _match_lines(lines, matcher):
+    return filter(matcher, lines)
+
+
+def _line_key(line, field=None, regex=None, numeric=False, natural=False):
+    if field is not None:
+        fields = line.split()
+        line = fields[field - 1] if 0 < field <= len(fields) else ''
+    elif regex is not None:
+        m = regex.search(line)
+        line = (m.group(1) if regex.groups else m.group(0)) if m else ''
+
+    if numeric:
+        m = number_re.match(line)
+        return float(m.group(1)) if m else 0.0
+
+    if natural:
+        return [
+            int(part) if i % 2 else part
+            for i, part in enumerate(digits_re.split(line))
+        ]
+
+    return line
+
+
+def _sort_key(kws):
+    '''
+    Return a picklable key function for the ``sort`` options in ``kws``, or
+    ``None`` to compare whole lines.
+    '''
+    key = kws.get('key')
+    options = {
+        'field': key if isinstance(key, int) else None,
+        'regex': key if utils.is_regex(key) else None,
+        'numeric': kws.get('numeric', False),
+        'natural': kws.get('natural', False),
+    }
+    if key is not None and options['field'] is None and not options['regex']:
+        raise ValueError('Sort key must be a field number or regex')
+
+    if not any(options.values()):
+        return None
+
+    return partial(_line_key, **options)
+
+
+def _sort_memory(kws):
+    return utils.parse_size(kws.get('memory', utils.get_config('sort_memory')))
+
+
+def _sort_lines(lines, key, reverse, memory):
+    return external_sort(lines, key=key, reverse=reverse, memory=memory)
+
+
+def _uniq_lines(lines):
+    return (line for line, group in groupby(lines))
+
+
+def _count_lines(lines, memory):
+    for line, group in groupby(external_sort(lines, memory=memory)):
+        yield '{} {}'.format(sum(1 for _ in group), line)
+
+
+def _dedupe_lines(lines, capacity=None, error=None):
+    if capacity is not None:
+        seen = utils.BloomFilter(capacity, error)
+        yield from filter(seen.add, lines)
+        return
+
+    seen = set()
+    for line in lines:
+        if line not in seen:
+            seen.add(line)
+            yield line
+
+
+def _pipe_lines(all_data, step, *args):
+    '''
+    Apply a line generator ``step`` to each document, lazily for streams.
+    '''
+    return [
+        data.pipe(step, *args) if isinstance(data, LineStream)
+        else Lines(list(step(_prepare_lines(data), *args)))
+        for data in all_data
+    ]
+
+
+def newline_chunks(filename, count):
+    '''
+    Split a file into about ``count`` ranges of ``(start, end)`` bytes,
+    each but the last ending after a newline.
+    '''
+    size = os.path.getsize(filename)
+    if not size:
+        return []
+
+    step = max(size // count, 1)
+    bounds = [0]
+    with open(filename, 'rb') as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            while bounds[-1] < size:
+                pos = mm.find(b'\n', bounds[-1] + step - 1)
+                bounds.append(size if pos < 0 else pos + 1)
+
+    return list(zip(bounds, bounds[1:]))
+
+
+def _grep_chunk(filename, matcher, start, end, encoding='utf8'):
+    with open(filename, 'rb') as fp:
+        with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = mm[start:end].decode(encoding)
+
+    return [line for line in text.splitlines() if matcher(line)]
+
+
+GREP_MIN_CHUNK = 1 << 20
+GREP_MAX_CHUNK = 64 << 20
+
+
+def _grep_chunk_count(size, jobs):
+    '''
+    The number of chunks to split ``size`` bytes into: four per job, unless
+    that makes chunks smaller than ``GREP_MIN_CHUNK``, or more as needed to
+    keep them within ``GREP_MAX_CHUNK``, so a chunk's lines fit in memory.
+    '''
+    count = min(jobs * 4, size // GREP_MIN_CHUNK)
+    return max(1, count, -(-size // GREP_MAX_CHUNK))
+
+
+def _grep_file(filename, matcher, jobs):
+    '''
+    Yield the lines of a file matching ``matcher``, in order, scanning
+    newline aligned chunks of the file in a pool of ``jobs`` processes.
+    '''
+    size = os.path.getsize(filename)
+    chunks = newline_chunks(filename, _grep_chunk_count(size, jobs))
+    if not chunks:
+        return
+
+    with ProcessPoolExecutor(jobs) as pool:
+        scan = partial(_grep_chunk, filename, matcher)
+        for lines in pool.map(scan, *zip(*chunks)):
+            yield from lines
+
+
+def _grep_jobs(data, kws):
+    '''
+    The number of processes to scan a stream with: ``jobs`` if given, or
+    all CPUs for a file over the ``parallel_size`` setting. Only streams
+    read directly from a local file can be scanned in parallel.
+    '''
+    filename = data.filename()
+    jobs = kws.get('jobs')
+    if filename is None:
+        return 1
+
+    if jobs is None:
+        if os.path.getsize(filename) < utils.get_config('parallel_size'):
+            return 1
+
+        jobs = os.cpu_count() or 1
+
+    return jobs
+
+
+def _matcher(args, kws):
+    return utils.Matcher(
+        args,
+        mode=kws.get('mode', 'any'),
+        invert=kws.get('invert', False)
+    )
+
+
 @register
-def format(data, args, kws):
+def format(all_data, args, kws):
     '''
     Format each line, where the current line is passed using {}.
     '''
-    fmt = args[0]
-    return Lines([
-        fmt.format(line, lineno)
-        for lineno, line in enumerate(_prepare_lines(data), 1)
-    ])
+    return _pipe_lines(all_data, _format_lines, args[0])
 
 
 @register
-def strip(data, args, kws):
+def strip(all_data, args, kws):
     '''
     Strip whitespace from content.
     '''
-    return Lines([l.strip() for l in _prepare_lines(data)])
+    results = []
+    for data in all_data:
+        if isinstance(data, LineStream):
+            results.append(data.pipe(_strip_lines))
+            continue
+
+        lines = _prepare_lines(data)
+        starts = array('q')
+        ends = array('q')
+        for start, line in zip(lines._starts, lines):
+            stripped = line.lstrip()
+            start += len(line) - len(stripped)
+            starts.append(start)
+            ends.append(start + len(stripped.rstrip()))
+
+        results.append(Lines(lines._data, memoryview(starts), memoryview(ends)))
+
+    return results
 
 
 @register
-def lines(data, args, kws):
-    return Lines(_prepare_lines(data))
+def lines(all_data, args, kws):
+    '''
+    Read each document, including streamed ones, into lines.
+    '''
+    return [Lines(data) for data in all_data]
 
 
 @register
-def skip_to(data, args, kws):
+def skip_to(all_data, args, kws):
     '''
-    Skip lines until finding a matching line.
+    Skip lines until finding a line matching any of the patterns, as for
+    ``matches``.
     '''
-    lines = _prepare_lines(data)
-    keep = kws.pop('keep', False)
-    found = strutil.find_first(lines, str(args[0]))
-    if found is not None:
-        if not keep:
-            found += 1
+    what = _matcher(args, kws)
+    keep = kws.get('keep', False)
+    results = []
+    for data in all_data:
+        if isinstance(data, LineStream):
+            # Streams are read twice: to find the line, then to skip to it
+            results.append(data.pipe(_skip_lines, what, keep))
+            continue
 
-        lines = lines[found:]
+        lines = _prepare_lines(data)
+        found = lines.find(what)
+        if found is not None:
+            if not keep:
+                found += 1
 
-    return Lines(lines)
+            lines = lines[found:]
+
+        results.append(lines)
+
+    return results
 
 
 @register
-def read_until(data, args, kws):
+def read_until(all_data, args, kws):
     '''
-    Save lines until finding a matching line.
+    Save lines until finding a line matching any of the patterns, as for
+    ``matches``.
     '''
-    keep = kws.pop('keep', False)
-    lines = _prepare_lines(data)
-    found = strutil.find_first(lines, str(args[0]))
-    if found is not None:
-        if keep:
-            found += 1
+    what = _matcher(args, kws)
+    keep = kws.get('keep', False)
+    results = []
+    for data in all_data:
+        if isinstance(data, LineStream):
+            results.append(data.pipe(_read_lines, what, keep))
+            continue
+
+        lines = _prepare_lines(data)
+        found = lines.find(what)
+        if found is not None:
+            if keep:
+                found += 1
 
-        lines = lines[:found]
+            lines = lines[:found]
 
-    return Lines(lines)
+        results.append(lines)
+
+    return results
 
 
 @register
-def matches(data, args, kws):
+def matches(all_data, args, kws):
     '''
-    Save lines matching the input.
+    Save lines matching the patterns: strings contained in the line, or
+    regexes matching from its start. With ``mode``, a line must match
+    ``any`` (the default), ``all`` or ``none`` of them; ``invert=True``
+    saves the lines that do not match instead.
+
+    Lines streamed from a local file are scanned in parallel over a memory
+    map, by ``jobs`` processes, or by all CPUs for files over the
+    ``parallel_size`` setting.
     '''
-    return Lines(
-        [l for l in _prepare_lines(data) if strutil.matches(l, args[0])]
+    what = _matcher(args, kws)
+    results = []
+    for data in all_data:
+        if isinstance(data, LineStream):
+            jobs = _grep_jobs(data, kws)
+            if jobs > 1:
+                results.append(LineStream(
+                    partial(_grep_file, data.filename(), what, jobs)
+                ))
+            else:
+                results.append(data.pipe(_match_lines, what))
+            continue
+
+        lines = _prepare_lines(data)
+        results.append(lines.subset(lines.iter_matches(what)))
+
+    return results
+
+
+@register
+def sort(all_data, args, kws):
+    '''
+    Sort lines, optionally by a ``key``: a whitespace separated field,
+    counting from 1, or the first group, if any, of a regex match. Keys
+    compare by their leading number with ``numeric=True``, or by runs of
+    digits as numbers with ``natural=True``, so that ``a2`` sorts before
+    ``a10``; ``reverse=True`` sorts in descending order.
+
+    Beyond ``memory`` bytes, by default the ``sort_memory`` setting, sorted
+    runs of lines are spilled to temporary files and merged. Sizes with
+    units must be quoted, as in ``memory='64M'``.
+    '''
+    utils.check_args('sort', args)
+    return _pipe_lines(
+        all_data,
+        _sort_lines,
+        _sort_key(kws),
+        kws.get('reverse', False),
+        _sort_memory(kws)
     )
+
+
+@register
+def uniq(all_data, args, kws):
+    '''
+    Collapse runs of identical adjacent lines into one, as for ``uniq``.
+    '''
+    return _pipe_lines(all_data, _uniq_lines)
+
+
+@register
+def count(all_data, args, kws):
+    '''
+    Replace the lines with each distinct line, in sorted order, prefixed
+    by its number of occurrences, as for ``sort | uniq -c``. The lines are
+    sorted externally as for ``sort``.
+    '''
+    utils.check_args('count', args)
+    return _pipe_lines(all_data, _count_lines, _sort_memory(kws))
+
+
+@register
+def dedupe(all_data, args, kws):
+    '''
+    Remove repeated lines, keeping the first occurrence of each line, in
+    order. With ``approximate=True``, the lines seen are kept in a Bloom
+    filter of fixed size rather than a set: for up to ``capacity`` lines
+    (default one million), a line is wrongly dropped at a rate of about
+    ``error`` (default 0.001).
+    '''
+    if kws.get('approximate'):
+        args = (kws.get('capacity', 10 ** 6), kws.get('error', 0.001))
+    else:
+        args = ()
+
+    return _pipe_lines(all_data, _dedupe_lines, *args)
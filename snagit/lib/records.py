@@ -0,0 +1,66 @@
+# -*- coding:utf8 -*-
+import csv
+import json
+import logging
+
+from . import DataProxy
+
+logger = logging.getLogger(__name__)
+
+
+class Records(DataProxy):
+    '''
+    Handler for a list of flat records (dicts), written as JSON lines or CSV.
+    '''
+
+    __slots__ = ()
+
+    def __init__(self, data):
+        if isinstance(data, Records):
+            data = data._data
+        elif isinstance(data, (str, bytes)):
+            data = data.decode() if isinstance(data, bytes) else data
+            data = [json.loads(line) for line in data.splitlines() if line]
+
+        self._data = list(data)
+
+    def __str__(self):
+        return '\n'.join(self.iter_jsonl())
+
+    def iter_jsonl(self):
+        for record in self._data:
+            yield json.dumps(record, ensure_ascii=False)
+
+    def fieldnames(self):
+        names = {}
+        for record in self._data:
+            names.update(dict.fromkeys(record))
+
+        return list(names)
+
+    def write(self, fp, format='jsonl', **kws):
+        '''
+        Write the records to ``fp`` as JSON lines, or with ``format='csv'``,
+        as CSV with a header row.
+        '''
+        if format == 'csv':
+            writer = csv.DictWriter(
+                fp,
+                self.fieldnames(),
+                lineterminator='\n'
+            )
+            writer.writeheader()
+            writer.writerows(self._data)
+        else:
+            sep = ''
+            for line in self.iter_jsonl():
+                fp.write(sep + line)
+                sep = '\n'
+
+    @classmethod
+    def merge(cls, all_data):
+        data = []
+        for records in all_data:
+            data += records._data
+
+        return cls(data)
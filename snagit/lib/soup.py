@@ -3,26 +3,321 @@ import re
 import os
 import json
 import logging
+import functools
 from copy import copy
+from itertools import chain
 from pprint import pformat
+from html.parser import HTMLParser
 
 import bs4
+import soupsieve
 import strutil
 
 from . import DataProxy, library
+from .records import Records
 from .. import utils
 
 logger = logging.getLogger(__name__)
 register = library.register('Soup')
-_feature = None
 
+# Parsers tried, in order, by the ``'auto'`` feature
+AUTO_FEATURES = ('lxml', 'html5lib', 'html.parser')
 
-def get_bs4_feature():
-    global _feature
-    if _feature is None:
-        _feature = utils.get_config('parser')
 
-    return _feature
+def get_bs4_feature(feature=None):
+    return feature or utils.get_config('parser')
+
+
+def parse_markup(markup, feature=None, parse_only=None):
+    '''
+    Parse ``markup`` with the given bs4 ``feature``, or the configured
+    parser. The ``'auto'`` feature tries the fast parsers first, falling
+    back to the next one if a parser is unavailable or fails.
+    '''
+    feature = get_bs4_feature(feature)
+    if feature != 'auto':
+        return bs4.BeautifulSoup(markup, feature, parse_only=parse_only)
+
+    for feature in AUTO_FEATURES:
+        try:
+            soup = bs4.BeautifulSoup(markup, feature, parse_only=parse_only)
+        except bs4.FeatureNotFound:
+            continue
+        except Exception as exc:
+            logger.debug('Parser {} failed: {}'.format(feature, exc))
+            continue
+
+        # A strained parse may rightly be empty
+        if soup.contents or parse_only is not None or not markup.strip():
+            return soup
+
+    raise ValueError('No parser could handle the markup')
+
+
+@functools.lru_cache(maxsize=512)
+def _compile_selector(selector, namespaces):
+    return soupsieve.compile(
+        selector,
+        namespaces=dict(namespaces) if namespaces else None
+    )
+
+
+def compile_selector(selector, namespaces=None):
+    '''
+    Return the compiled ``soupsieve`` form of a CSS ``selector``, cached by
+    selector and namespaces for reuse across documents. This skips the
+    per-call work ``BeautifulSoup.select`` does before reaching soupsieve's
+    own cache.
+    '''
+    key = tuple(sorted(namespaces.items())) if namespaces else None
+    return _compile_selector(selector, key)
+
+
+simple_selector_re = re.compile(r'^([\w-]*)((?:[.#][\w-]+)*)$')
+combinator_re = re.compile(r'\s*(>)\s*|\s+')
+
+
+@functools.lru_cache(maxsize=512)
+def parse_simple_selector(selector):
+    '''
+    Split ``selector`` into a tuple of ``(combinator, name, id, classes)``
+    tuples, or return ``None`` if it uses anything beyond ``tag.class#id``
+    compounds joined by descendant (``' '``) or child (``'>'``) combinators.
+    '''
+    bits = combinator_re.split(selector.strip())
+    combinators = [' '] + [c or ' ' for c in bits[1::2]]
+    compounds = []
+    for combinator, compound in zip(combinators, bits[0::2]):
+        m = simple_selector_re.match(compound)
+        if not (compound and m):
+            return None
+
+        name, rest = m.groups()
+        ids = [p[1:] for p in re.findall(r'#[\w-]+', rest)]
+        classes = tuple(p[1:] for p in re.findall(r'\.[\w-]+', rest))
+        compounds.append((combinator, name, ids[0] if ids else None, classes))
+
+    return tuple(compounds)
+
+
+def make_strainer(selector):
+    '''
+    Return a ``bs4.SoupStrainer`` that keeps only the subtrees able to
+    contain matches for ``selector``, or ``None`` if ``selector`` is not a
+    simple selector, as per ``parse_simple_selector``.
+    '''
+    compounds = parse_simple_selector(selector)
+    if not compounds:
+        return None
+
+    combinator, name, id_, classes = compounds[0]
+    attrs = {}
+    if id_:
+        attrs['id'] = id_
+
+    if classes:
+        attrs['class'] = re.compile(r'(^|\s){}(\s|$)'.format(classes[0]))
+
+    return bs4.SoupStrainer(name or None, attrs=attrs)
+
+
+class ElementIndex:
+    '''
+    Maps tag names, ids and classes to elements, in document order, so that
+    single ``tag.class#id`` selectors are answered without walking the tree.
+    Elements removed from the tree may be passed to ``remove``; any other
+    change requires a new index.
+    '''
+
+    def __init__(self, root):
+        self.names = {}
+        self.ids = {}
+        self.classes = {}
+        self.removed = set()
+        for el in root.find_all(True):
+            self.names.setdefault(el.name, []).append(el)
+            id_ = el.get('id')
+            if id_:
+                self.ids.setdefault(id_, []).append(el)
+
+            for cls in el.get('class') or ():
+                self.classes.setdefault(cls, []).append(el)
+
+    def select(self, selector, limit=None):
+        '''
+        Return the elements matching ``selector``, or ``None`` if it is not a
+        single simple compound.
+        '''
+        compounds = parse_simple_selector(selector)
+        if not compounds or len(compounds) > 1:
+            return None
+
+        combinator, name, id_, classes = compounds[0]
+        name = name.lower()
+        if id_:
+            candidates = self.ids.get(id_, ())
+        elif classes:
+            candidates = self.classes.get(classes[0], ())
+        elif name:
+            candidates = self.names.get(name, ())
+        else:
+            return None
+
+        results = []
+        for el in candidates:
+            if id(el) in self.removed:
+                continue
+
+            if name and el.name != name:
+                continue
+
+            if id_ and el.get('id') != id_:
+                continue
+
+            if classes and not set(classes) <= set(el.get('class') or ()):
+                continue
+
+            results.append(el)
+            if limit and len(results) == limit:
+                break
+
+        return results
+
+    def remove(self, el, descendants=True):
+        self.removed.add(id(el))
+        if descendants and isinstance(el, bs4.Tag):
+            self.removed.update(id(d) for d in el.find_all(True))
+
+
+class StreamSelector(HTMLParser):
+    '''
+    Incrementally parse markup fed in chunks, collecting the raw markup of
+    each element matching a simple selector as soon as it closes. Only the
+    open element stack and the current match are kept by the parser. Matches
+    nested inside another match are returned as part of the outer one.
+    '''
+
+    void_tags = set(
+        utils.get_config('non_closing_tags') +
+        'area col embed track wbr'.split()
+    )
+    implied_end = {
+        'li': ('li',),
+        'tr': ('tr', 'td', 'th'),
+        'td': ('td', 'th'),
+        'th': ('td', 'th'),
+        'p': ('p',),
+        'option': ('option',),
+        'dt': ('dt', 'dd'),
+        'dd': ('dt', 'dd'),
+    }
+
+    def __init__(self, selector):
+        super().__init__(convert_charrefs=False)
+        self.compounds = parse_simple_selector(selector)
+        if not self.compounds:
+            raise ValueError('Unsupported stream selector: {}'.format(selector))
+
+        self.stack = []
+        self.capture = None
+        self.capture_depth = 0
+        self.matches = []
+
+    def iter_select(self, chunks):
+        for chunk in chunks:
+            self.feed(chunk)
+            yield from self.matches
+            del self.matches[:]
+
+        self.close()
+        while self.stack:
+            self._pop()
+
+        yield from self.matches
+        del self.matches[:]
+
+    def _compound_matches(self, index, element):
+        combinator, name, id_, classes = self.compounds[index]
+        tag, attrs = element
+        if name and name != tag:
+            return False
+
+        if id_ and attrs.get('id') != id_:
+            return False
+
+        return set(classes) <= set((attrs.get('class') or '').split())
+
+    def _match(self, index, depth):
+        if not self._compound_matches(index, self.stack[depth]):
+            return False
+
+        if index == 0:
+            return True
+
+        if self.compounds[index][0] == '>':
+            return depth > 0 and self._match(index - 1, depth - 1)
+
+        return any(self._match(index - 1, d) for d in range(depth - 1, -1, -1))
+
+    def _append(self, text):
+        if self.capture is not None:
+            self.capture.append(text)
+
+    def _pop(self):
+        tag, attrs = self.stack[-1]
+        self._append('</{}>'.format(tag))
+        if self.capture is not None and len(self.stack) == self.capture_depth:
+            self.matches.append(''.join(self.capture))
+            self.capture = None
+
+        self.stack.pop()
+
+    def handle_starttag(self, tag, attrs):
+        closes = self.implied_end.get(tag, ())
+        while self.stack and self.stack[-1][0] in closes:
+            self._pop()
+
+        text = self.get_starttag_text()
+        self._append(text)
+        self.stack.append((tag, dict(attrs)))
+        if self.capture is None and self._match(
+            len(self.compounds) - 1,
+            len(self.stack) - 1
+        ):
+            self.capture = [text]
+            self.capture_depth = len(self.stack)
+
+        if tag in self.void_tags:
+            if self.capture is not None and \
+                    len(self.stack) == self.capture_depth:
+                self.matches.append(text)
+                self.capture = None
+
+            self.stack.pop()
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        if tag not in self.void_tags:
+            self._pop()
+
+    def handle_endtag(self, tag):
+        if any(t == tag for t, a in self.stack):
+            while self.stack[-1][0] != tag:
+                self._pop()
+
+            self._pop()
+
+    def handle_data(self, data):
+        self._append(data)
+
+    def handle_entityref(self, name):
+        self._append('&{};'.format(name))
+
+    def handle_charref(self, name):
+        self._append('&#{};'.format(name))
+
+    def handle_comment(self, data):
+        self._append('<!--{}-->'.format(data))
 
 
 class Formatter:
@@ -48,61 +343,87 @@ class Formatter:
 
         return attrs
 
-    def format_element(self, el, lines, depth=0, prefix='    '):
-        indent = prefix * depth
-        if isinstance(el, bs4.NavigableString):
-            el = el.strip()
-            if el:
-                lines.append('{}{}'.format(indent, el))
-            return lines
-
-        line = '{}<{}{}>'.format(indent, el.name, self.format_attrs(el))
-        if el.name in self.non_closing:
-            lines.append(line)
-            for ct in el.contents:
-                lines = self.format_element(ct, lines, depth, prefix)
-            return lines
-
-        n_children = len(el.contents)
-        if n_children:
-            if n_children > 1 or isinstance(el.contents[0], bs4.Tag):
-                lines.append(line)
-                for ct in el.contents:
-                    ct_depth = depth if ct.name in self.no_indent else depth + 1
-                    lines = self.format_element(ct, lines, ct_depth, prefix)
-                lines.append('{}</{}>'.format(indent, el.name))
+    def iter_element(self, el, depth=0, prefix='    '):
+        '''
+        Yield the formatted lines of ``el`` and its descendants. The tree is
+        walked with an explicit stack, so depth is not limited by recursion.
+        '''
+        stack = [(el, depth)]
+        while stack:
+            el, depth = stack.pop()
+            if el is None:
+                # A closing tag line, already formatted
+                yield depth
+                continue
+
+            indent = prefix * depth
+            if isinstance(el, bs4.NavigableString):
+                el = el.strip()
+                if el:
+                    yield '{}{}'.format(indent, el)
+                continue
+
+            line = '{}<{}{}>'.format(indent, el.name, self.format_attrs(el))
+            if el.name in self.non_closing:
+                yield line
+                stack.extend((ct, depth) for ct in reversed(el.contents))
+                continue
+
+            n_children = len(el.contents)
+            if n_children:
+                if n_children > 1 or isinstance(el.contents[0], bs4.Tag):
+                    yield line
+                    stack.append((None, '{}</{}>'.format(indent, el.name)))
+                    stack.extend(
+                        (ct, depth if ct.name in self.no_indent else depth + 1)
+                        for ct in reversed(el.contents)
+                    )
+                else:
+                    yield '{}{}</{}>'.format(
+                        line,
+                        el.contents[0].strip(),
+                        el.name
+                    )
             else:
-                lines.append(
-                    '{}{}</{}>'.format(line, el.contents[0].strip(), el.name)
-                )
-        else:
-            lines.append('{}</{}>'.format(line, el.name))
+                yield '{}</{}>'.format(line, el.name)
 
+    def format_element(self, el, lines, depth=0, prefix='    '):
+        lines.extend(self.iter_element(el, depth, prefix))
         return lines
 
-    def format(self, el, depth=0, prefix='    ', doctype=True):
-        lines = []
+    def iter_format(self, el, depth=0, prefix='    ', doctype=True):
         if not el and el.contents:
-            return ''
+            return
 
         contents = iter(el.contents)
         if isinstance(el, bs4.BeautifulSoup):
             if not el.contents:
-                return ''
+                return
 
             first = el.contents[0]
             if isinstance(first, bs4.Doctype):
-                lines.append(str(first.output_ready()).strip())
+                yield str(first.output_ready()).strip()
                 next(contents)
 
         for child in contents:
-            lines = self.format_element(child, lines, depth, prefix)
+            yield from self.iter_element(child, depth, prefix)
+
+    def format(self, el, depth=0, prefix='    ', doctype=True):
+        return '\n'.join(self.iter_format(el, depth, prefix, doctype))
 
-        # from pprint import pprint; pprint(lines)
-        return '\n'.join(lines)
+    def write(self, el, fp, depth=0, prefix='    ', doctype=True):
+        '''
+        Write the formatted lines of ``el`` to the file-like ``fp`` as they
+        are produced.
+        '''
+        sep = ''
+        for line in self.iter_format(el, depth, prefix, doctype):
+            fp.write(sep + line)
+            sep = '\n'
 
 
-formatter = Formatter().format
+_formatter = Formatter()
+formatter = _formatter.format
 
 
 def is_soup(what):
@@ -117,10 +438,16 @@ def is_navigable_string(what):
     return isinstance(what, bs4.NavigableString)
 
 
-def make_soup(contents='', feature=None):
-    feature = feature or get_bs4_feature()
+def make_soup(contents='', feature=None, parse_only=None, reparent=False):
+    '''
+    Create a ``BeautifulSoup`` from markup, a soup, or a list of elements.
+
+    Elements are copied into the new soup, unless ``reparent`` is set, in
+    which case they are moved, and the tree they came from must be discarded.
+    Elements nested within an already moved element are still copied.
+    '''
     if isinstance(contents, (str, bytes)):
-        return bs4.BeautifulSoup(contents, feature)
+        return parse_markup(contents, feature, parse_only)
 
     if is_soup(contents):
         contents = contents.contents
@@ -130,46 +457,258 @@ def make_soup(contents='', feature=None):
     elif not isinstance(contents, list):
         raise ValueError('Cannot create soup from type {}'.format(type(contents)))  # noqa
 
-    soup = bs4.BeautifulSoup('', feature)
+    soup = parse_markup('', feature)
+    if not reparent:
+        for el in contents:
+            soup.append(copy(el))
+
+        return soup
+
+    moved = set()
     for el in contents:
-        soup.append(copy(el))
+        if any(id(parent) in moved for parent in el.parents):
+            soup.append(copy(el))
+        else:
+            # Unlink without ``extract``, whose ``Tag.index`` lookup is
+            # linear in the number of siblings; the old tree is discarded.
+            moved.add(id(el))
+            el.parent = None
+            soup.append(el)
+
+    return soup
+
+
+def dump_tree(root):
+    '''
+    Flatten the tree under ``root`` into a picklable list, without recursion:
+    ``(type, text)`` for each string, and ``(name, namespace, prefix, attrs)``
+    for each tag, followed by its contents and ``None``.
+    '''
+    items = []
+    stack = [iter(root.contents)]
+    while stack:
+        el = next(stack[-1], None)
+        if el is None:
+            stack.pop()
+            items.append(None)
+        elif isinstance(el, bs4.Tag):
+            items.append((el.name, el.namespace, el.prefix, dict(el.attrs)))
+            stack.append(iter(el.contents))
+        else:
+            items.append((type(el), str(el)))
+
+    return items
+
 
+def load_tree(items):
+    '''
+    Rebuild the tree flattened by ``dump_tree``, node for node, rather than
+    parsing its markup again.
+    '''
+    soup = parse_markup('', 'html.parser')
+    stack = [soup]
+    for item in items:
+        if item is None:
+            stack.pop()
+        elif len(item) == 2:
+            stack[-1].append(item[0](item[1]))
+        else:
+            name, namespace, prefix, attrs = item
+            tag = bs4.Tag(soup, soup.builder, name, namespace, prefix, attrs)
+            stack[-1].append(tag)
+            stack.append(tag)
+
+    return soup
+
+
+def _load_soup(items, indexed, source_size):
+    soup = Soup.wrap(load_tree(items))
+    soup._index = True if indexed else None
+    soup._source_size = source_size
     return soup
 
 
 class Soup(DataProxy):
     '''
     Handler for manipulating a block of Soup.
+
+    The optional element index is a per-document lazy cache: ``_index`` is
+    ``None`` when off, ``True`` when stale, or an ``ElementIndex``. Copies,
+    selection results and changes other than removals mark it stale, and
+    it is rebuilt on the next lookup.
     '''
 
-    def __init__(self, data):
+    __slots__ = ('_rendered', '_index', '_shared', '_source_size')
+
+    def __init__(self, data, feature=None, parse_only=None):
+        self._rendered = None
+        self._index = None
+        self._shared = True
+        self._source_size = None
+        if isinstance(data, Soup) and not data._shared:
+            # The source was released, so take over its tree without copying
+            data._shared = True
+            self._data = data._data
+            self._index = data._index
+            self._source_size = data._source_size
+            return
+
         if isinstance(data, Soup):
+            self._index = True if data._index is not None else None
+            self._source_size = data._source_size
             data = data._data
 
-        self._data = make_soup(data if is_soup(data) else str(data))
+        if not is_soup(data):
+            data = str(data)
+            self._source_size = len(data)
+
+        self._data = make_soup(data, feature, parse_only)
+
+    @classmethod
+    def wrap(cls, soup):
+        '''
+        Create a ``Soup`` around an existing ``BeautifulSoup`` tree, without
+        copying it.
+        '''
+        self = cls.__new__(cls)
+        self._data = soup
+        self._rendered = None
+        self._index = None
+        self._shared = True
+        self._source_size = None
+        return self
+
+    def release(self):
+        self._shared = False
 
     def __str__(self):
-        return formatter(self._data)
+        if self._rendered is None:
+            self._rendered = formatter(self._data)
+
+        return self._rendered
+
+    def changed(self, keep_index=False):
+        '''
+        Discard the cached rendering, and mark the element index stale unless
+        the command only removed elements passed to ``forget``. Commands call
+        this after mutating the tree.
+        '''
+        self._rendered = None
+        if self._index is not None and not keep_index:
+            self._index = True
+
+    def size(self):
+        '''
+        Estimated size: the length of the cached rendering, or else of the
+        markup the soup was parsed from. Only a soup built from elements is
+        rendered to find out, and the rendering is kept for output.
+        '''
+        if self._rendered is not None:
+            return len(self._rendered)
+
+        if self._source_size is not None:
+            return self._source_size
+
+        return len(str(self))
+
+    def build_index(self):
+        self._index = ElementIndex(self._data)
+
+    def drop_index(self):
+        self._index = None
+
+    def forget(self, el, descendants=True):
+        '''
+        Remove ``el``, and by default its descendants, from the element index.
+        '''
+        self._rendered = None
+        if isinstance(self._index, ElementIndex):
+            self._index.remove(el, descendants)
+
+    def __reduce__(self):
+        # Pickle the tree itself, as parsing its markup again could merge
+        # strings; an index is rebuilt on the next lookup
+        return (_load_soup, (
+            dump_tree(self._data),
+            self._index is not None,
+            self._source_size
+        ))
+
+    def write(self, fp, raw=False, **kws):
+        '''
+        Stream the formatted soup to ``fp``, or its unindented markup if
+        ``raw``.
+        '''
+        if raw:
+            fp.write(str(self._data))
+        elif self._rendered is not None:
+            fp.write(self._rendered)
+        else:
+            _formatter.write(self._data, fp)
+
+    # Elements handed out may be changed by the caller, so each accessor
+    # discards the cached rendering
+
+    @property
+    def children(self):
+        self._rendered = None
+        return self._data.children
+
+    def select(self, selector, limit=None, namespaces=None):
+        self._rendered = None
+        if self._index is not None and not namespaces:
+            if self._index is True:
+                self.build_index()
+
+            results = self._index.select(selector, limit)
+            if results is not None:
+                return results
+
+        compiled = compile_selector(selector, namespaces)
+        return compiled.select(self._data, limit=limit or 0)
+
+    def find_all(self, *args, **kws):
+        self._rendered = None
+        return self._data.find_all(*args, **kws)
 
     @classmethod
     def merge(cls, all_data):
         results = []
         for soup in all_data:
-            results += [copy(e) for e in soup.children]
+            if soup._shared:
+                results += [copy(e) for e in soup.children]
+            else:
+                soup._shared = True
+                results += list(soup.children)
 
-        return cls(make_soup(results))
+        return cls.wrap(make_soup(results, reparent=True))
 
 
 bad_attrs = utils.get_config('bad_attrs')
 
 
-def _invoke_cmd(data, cmd, args):
-    soup = Soup(data)
+@register
+def parse(data, args, kws):
+    '''
+    Parse (or re-parse) the content as soup, using the parser named by the
+    optional argument: ``lxml``, ``html5lib``, ``html.parser`` or ``auto``.
+    '''
+    feature = args[0] if args else kws.get('parser')
+    if isinstance(data, Soup):
+        data = str(data._data)
+
+    return Soup(data, feature)
+
+
+def _invoke_cmd(data, cmd, args, kws):
+    soup = Soup(data, kws.get('parser'))
     for item in args:
         for el in soup.select(item):
             method = getattr(el, cmd)
             method()
+            soup.forget(el, descendants=cmd != 'unwrap')
 
+    soup.changed(keep_index=True)
     return soup
 
 
@@ -178,7 +717,7 @@ def unwrap(data, args, kws):
     '''
     Replace an element with its child contents.
     '''
-    return _invoke_cmd(data, 'unwrap', args)
+    return _invoke_cmd(data, 'unwrap', args, kws)
 
 
 @register
@@ -186,54 +725,170 @@ def unwrap_attr(data, args, kws):
     '''
     Replace an element with the content for a specified attribute.
     '''
-    soup = Soup(data)
+    soup = Soup(data, kws.get('parser'))
     for el in soup.select(args[0]):
         what = getattr(el, 'attrs', {}).get(args[1], '')
         if isinstance(what, (list, tuple)):
             what = ' '.join(what)
         
         el.replace_with(what)
+        soup.forget(el)
 
+    soup.changed(keep_index=True)
     return soup
 
 
-@register
-def normalize_tag(data, args, kws):
+TEXT_TYPES = {bs4.NavigableString, bs4.CData}
+
+
+def _text_types(tag):
     '''
-    Combine consecutive navigable strings, compressing whitespace.
+    The string types counted as text of ``tag``, as by ``stripped_strings``.
     '''
-    args = args or ['*']
-    soup = Soup(data)
-    for arg in args:
-        for tag in soup.select(arg):
-            cleaned = []
-            children = []
-            while tag.contents:
-                children.append(tag.contents[0].extract())
-
-            for el in children:
-                if isinstance(el, bs4.NavigableString):
-                    result = ' '.join(el.split())
-                    cleaned.append(result)
-                else:
-                    if cleaned:
-                        tag.append(' '.join(cleaned))
+    types = getattr(tag, 'interesting_string_types', None)
+    if types is None:
+        return TEXT_TYPES
+
+    return {types} if isinstance(types, type) else types
+
+
+def _relink(tag, children, ends, after):
+    '''
+    Make ``children`` the contents of ``tag`` in one pass, where ``ends``
+    holds the last descendant of each child and ``after`` is the element
+    following ``tag``. Unlike repeated ``extract`` and ``append`` calls,
+    this is linear in the number of children.
+    '''
+    previous = None
+    end = tag
+    for child, child_end in zip(children, ends):
+        child.parent = tag
+        child.previous_sibling = previous
+        child.previous_element = end
+        end.next_element = child
+        if previous is not None:
+            previous.next_sibling = child
+
+        previous = child
+        end = child_end
+
+    if previous is not None:
+        previous.next_sibling = None
+
+    end.next_element = after
+    if after is not None:
+        after.previous_element = end
+
+    tag.contents = children
+    return end
+
+
+def _merge_strings(children, ends):
+    cleaned = []
+    results = ([], [])
+
+    def flush():
+        if cleaned:
+            text = bs4.NavigableString(' '.join(cleaned))
+            results[0].append(text)
+            results[1].append(text)
+            del cleaned[:]
+
+    for child, end in zip(children, ends):
+        if isinstance(child, bs4.NavigableString):
+            cleaned.append(' '.join(child.split()))
+        else:
+            flush()
+            results[0].append(child)
+            results[1].append(end)
+
+    flush()
+    return results
+
+
+def _rewrite(soup, normalize=(), prune=()):
+    '''
+    Rewrite the tree of ``soup`` in a single post-order walk: tags whose
+    ``id`` is in ``prune`` are removed when they have no attributes and no
+    text, and consecutive strings of tags in ``normalize`` are combined
+    with whitespace compressed.
+    '''
+    soup.changed(keep_index=True)
+    found = {}
+    last = {}
+    stack = [(soup._data, False)]
+    while stack:
+        tag, visited = stack.pop()
+        if not visited:
+            stack.append((tag, True))
+            stack.extend(
+                (child, False) for child in reversed(tag.contents)
+                if isinstance(child, bs4.Tag)
+            )
+            continue
+
+        types = set()
+        children = []
+        ends = []
+        end = tag
+        for child in tag.contents:
+            if isinstance(child, bs4.Tag):
+                child_types = found.pop(id(child))
+                end = last.pop(id(child))
+                types |= child_types
+                if id(child) in prune and not (
+                    any(child.attrs) or
+                    not child_types.isdisjoint(_text_types(child))
+                ):
+                    soup.forget(child)
+                    continue
+            else:
+                end = child
+                if child.strip():
+                    types.add(type(child))
+
+            children.append(child)
+            ends.append(end)
+
+        after = end.next_element
+        if id(tag) in normalize:
+            children, ends = _merge_strings(children, ends)
+
+        if len(children) != len(tag.contents) or id(tag) in normalize:
+            end = _relink(tag, children, ends, after)
+        else:
+            end = ends[-1] if ends else tag
 
-                    tag.append(el)
-                    cleaned = []
+        found[id(tag)] = types
+        last[id(tag)] = end
 
-            if cleaned:
-                tag.append(' '.join(cleaned))
 
+def _select_ids(soup, args):
+    return {id(el) for arg in args for el in soup.select(arg)}
+
+
+@register
+def normalize_tag(data, args, kws):
+    '''
+    Combine consecutive navigable strings, compressing whitespace.
+    '''
+    soup = Soup(data, kws.get('parser'))
+    _rewrite(soup, normalize=_select_ids(soup, args or ['*']))
+    soup.changed(keep_index=True)
     return soup
 
 
 @register
 def extract(data, args, kws):
     '''
-    Removes the specified elements.
+    Removes the specified elements. For a ``Tree``, selectors may also be
+    XPath, and the work is done by lxml.
     '''
-    return _invoke_cmd(data, 'extract', args)
+    from .tree import Tree, drop
+    if isinstance(data, Tree):
+        return drop(data, args, kws)
+
+    return _invoke_cmd(data, 'extract', args, kws)
 
 
 @register
@@ -242,12 +897,13 @@ def replace_tag_string(data, args, kws):
     Do replacement on element strings
     '''
     query, old, new, *other = args
-    soup = Soup(data)
+    soup = Soup(data, kws.get('parser'))
     for el in soup.select(query):
         s = el.string
         if s:
             el.string = strutil.replace(s, old, new)
 
+    soup.changed()
     return soup
 
 
@@ -256,40 +912,191 @@ def replace_with(data, args, kws):
     '''
     Replace the specified tag with some plain text.
     '''
-    soup = Soup(data)
+    soup = Soup(data, kws.get('parser'))
     for el in soup.select(args[0]):
         el.replace_with(args[1])
+        soup.forget(el)
 
+    soup.changed(keep_index=True)
     return soup
 
 
 def _handle_results(soup, results):
     logger.debug('Selected {} matches'.format(len(results)))
     if results:
-        soup._data = make_soup(results)
+        soup._data = make_soup(results, reparent=True)
+        soup._source_size = None
+        soup.changed()
 
     return soup
 
 
+class SoupStream(DataProxy):
+    '''
+    Lazily produced soups, such as the matches of ``select_stream`` over a
+    streamed source. As for ``LineStream``, the data is a picklable factory,
+    called each time the soups are iterated, so that only one soup at a time
+    is held while the stream is written.
+    '''
+
+    __slots__ = ()
+
+    def __str__(self):
+        return '\n'.join(str(soup) for soup in self)
+
+    def __iter__(self):
+        return iter(self._data())
+
+    def __len__(self):
+        return sum(1 for soup in self)
+
+    def size(self):
+        return 0
+
+    def iter_chunks(self, size=2 ** 16):
+        for soup in self:
+            yield str(soup._data) + '\n'
+
+    def write(self, fp, **kws):
+        sep = ''
+        for soup in self:
+            fp.write(sep)
+            soup.write(fp, **kws)
+            sep = '\n'
+
+    @classmethod
+    def merge(cls, all_data):
+        return cls(functools.partial(chain.from_iterable, list(all_data)))
+
+
+def _select_stream(data, selector, feature=None):
+    chunks = utils.iter_chunks(data)
+    for markup in StreamSelector(selector).iter_select(chunks):
+        yield Soup(markup, feature)
+
+
+@library.register('Soup', batch=True)
+def select_stream(all_data, args, kws):
+    '''
+    Incrementally scan each document for elements matching a simple
+    selector (``tag.class#id`` compounds joined by descendant or child
+    combinators), producing a separate soup for each match as it closes.
+
+    A streamed source, as loaded with ``stream=True``, becomes a single
+    ``SoupStream`` of its matches, which are only read and parsed as they
+    are written, so that memory is bounded by the largest match. Other
+    documents are already held in memory, and give a soup per match.
+    '''
+    selector = args[0]
+    feature = kws.get('parser')
+    for data in all_data:
+        if hasattr(data, 'iter_chunks'):
+            yield SoupStream(functools.partial(
+                _select_stream,
+                data,
+                selector,
+                feature
+            ))
+        else:
+            yield from _select_stream(data, selector, feature)
+
+
+def _parse_only(data, kws):
+    '''
+    Pop ``parse_only`` and ``parser`` from ``kws`` and parse ``data`` with
+    them, using a strainer for ``parse_only`` when ``data`` is not yet
+    parsed. Return the soup, the strainer used and the remaining keywords.
+
+    Partial parsing is only done on request: without the enclosing tags,
+    implicitly closed elements such as ``<li>`` or ``<p>`` may extend past
+    where a full parse would end them.
+    '''
+    kws = dict(kws)
+    feature = kws.pop('parser', None)
+    strainer = None
+    if 'parse_only' in kws:
+        selector = kws.pop('parse_only')
+        strainer = make_strainer(selector)
+        if strainer is None:
+            raise ValueError('Unsupported parse_only: {}'.format(selector))
+
+    if isinstance(data, Soup):
+        strainer = None
+
+    return Soup(data, feature, strainer), strainer, kws
+
+
+def _handle_strained(data, strainer, soup, results, feature=None):
+    '''
+    As for ``_handle_results``, except that with no results from a partial
+    parse, the whole document is parsed and kept unchanged.
+    '''
+    if strainer is not None and not results:
+        return Soup(data, feature)
+
+    return _handle_results(soup, results)
+
+
 @register
 def find_all(data, args, kws):
     '''
     Query elements using the `BeautifulSoup.find_all` API.
+
+    Unparsed content can be partially parsed with ``parse_only``, a tag name
+    or simple selector for the subtrees to keep.
     '''
-    soup = Soup(data)
-    results = soup.find_all(*args, **kws)
-    return _handle_results(soup, results)
+    soup, strainer, query = _parse_only(data, kws)
+    results = soup.find_all(*args, **query)
+    return _handle_strained(data, strainer, soup, results, kws.get('parser'))
 
 
 @register
 def select(data, args, kws):
     '''
     Query elements matching the CSS selection.
+
+    Unparsed content can be partially parsed with ``parse_only``, a chain of
+    simple ``tag.class#id`` compounds for the subtrees to keep.
     '''
-    soup = Soup(data)
     args = args[0] if args else '*'
+    soup, strainer, _ = _parse_only(data, kws)
     results = soup.select(args, limit=kws.get('limit'))
-    return _handle_results(soup, results)
+    return _handle_strained(data, strainer, soup, results, kws.get('parser'))
+
+
+def _record_field(row, spec):
+    selector, attr = spec.rsplit('@', 1) if '@' in spec else (spec, None)
+    el = compile_selector(selector).select_one(row) if selector else row
+    if el is None:
+        return None
+
+    if attr:
+        value = el.attrs.get(attr)
+        return ' '.join(value) if isinstance(value, (list, tuple)) else value
+
+    return ' '.join(el.get_text().split())
+
+
+@register
+def extract_records(data, args, kws):
+    '''
+    Extract one record per element matching the row selector ``args[0]``.
+    Each keyword maps a field name to a selector within the row, whose
+    compressed text becomes the value. ``selector@attr`` takes an attribute
+    instead, and ``@attr`` an attribute of the row itself. For example::
+
+        extract_records div.item title='h2 a' url='h2 a@href' price=.price
+
+    The result is written as JSON lines, or CSV with ``write ... format=csv``.
+    A ``parser`` keyword names the parser rather than a field.
+    '''
+    fields = dict(kws)
+    soup = Soup(data, fields.pop('parser', None))
+
+    return Records(
+        {name: _record_field(row, spec) for name, spec in fields.items()}
+        for row in soup.select(args[0])
+    )
 
 
 @register
@@ -297,13 +1104,72 @@ def extract_empty(data, args, kws):
     '''
     Remove empty tags
     '''
-    soup = Soup(data)
-    args = args or ['*']
-    for arg in args:
-        for el in soup.select(arg):
-            if not (any(el.attrs) or any(el.stripped_strings)):
-                el.extract()
+    soup = Soup(data, kws.get('parser'))
+    _rewrite(soup, prune=_select_ids(soup, args or ['*']))
+    soup.changed(keep_index=True)
+    return soup
+
+
+@register
+def index(data, args, kws):
+    '''
+    Build an index of tag names, ids and classes for each document, used to
+    answer simple selectors in following commands. ``index False`` drops it.
+    '''
+    soup = Soup(data, kws.get('parser'))
+    if args and not args[0]:
+        soup.drop_index()
+    else:
+        soup.build_index()
+
+    return soup
+
+
+@register
+def sanitize(data, args, kws):
+    '''
+    In a single pass, rename or remove the configured ``bad_tags`` and drop
+    the configured ``bad_attrs``. Any arguments are extra attribute names to
+    drop (``*`` wildcards allowed).
 
+    ``tags=j'{...}'`` and ``attrs='a b c'`` override the configured values,
+    and ``global_attrs=True`` also drops the ``global_attrs`` config
+    (``class``, ``id`` and ``style``).
+    '''
+    tags = kws.get('tags', utils.get_config('bad_tags')) or {}
+    attrs = kws.get('attrs', utils.get_config('bad_attrs')) or []
+    if isinstance(attrs, str):
+        attrs = attrs.split()
+
+    attrs = list(attrs) + list(args)
+    if kws.get('global_attrs'):
+        attrs += utils.get_config('global_attrs')
+
+    attrs_re = utils.normalize_search_attrs(attrs) if attrs else None
+    soup = Soup(data, kws.get('parser'))
+    stack = [soup._data]
+    while stack:
+        tag = stack.pop()
+        for el in list(tag.contents):
+            if not isinstance(el, bs4.Tag):
+                continue
+
+            if el.name in tags:
+                if not tags[el.name]:
+                    el.decompose()
+                    continue
+
+                el.name = tags[el.name]
+
+            if attrs_re and any(attrs_re.fullmatch(k) for k in el.attrs):
+                el.attrs = {
+                    k: v for k, v in el.attrs.items()
+                    if not attrs_re.fullmatch(k)
+                }
+
+            stack.append(el)
+
+    soup.changed()
     return soup
 
 
@@ -314,7 +1180,7 @@ def remove_attrs(data, args, kws):
     '''
     query = kws.get('query', '*')
     attrs_re = utils.normalize_search_attrs(args)
-    soup = Soup(data)
+    soup = Soup(data, kws.get('parser'))
 
     elements = soup.select(query)
     for el in elements:
@@ -323,4 +1189,5 @@ def remove_attrs(data, args, kws):
             if not attrs_re.match(k)
         }
 
+    soup.changed()
     return soup
@@ -1,40 +1,243 @@
 # -*- coding:utf8 -*-
+import re
 import logging
+import functools
 import strutil
 
 from . import DataProxy, library
+from .lines import LineStream
+from .. import utils
 
 logger = logging.getLogger(__name__)
-register = library.register('Text')
+register = library.register('Text', batch=True)
+
+
+@functools.lru_cache(maxsize=128)
+def compile_each(patterns):
+    '''
+    Compile strings and regexes into one regex matching any of them, or
+    return ``None`` if the regexes cannot be combined. Strings are matched
+    through a trie, longest first, and before any regex at the same
+    position.
+    '''
+    strings = list(dict.fromkeys(p for p in patterns if not utils.is_regex(p)))
+    regexes = [p for p in patterns if utils.is_regex(p)]
+    flags = set(r.flags for r in regexes)
+    if '' in strings or len(flags) > 1 or any(
+        utils.backref_re.search(r.pattern) for r in regexes
+    ):
+        return None
+
+    flags = flags.pop() if flags else 0
+    alternatives = []
+    if strings:
+        trie = utils.trie_regex(strings)
+        alternatives.append('(?-i:{})'.format(trie) if flags & re.I else trie)
+
+    alternatives.extend('(?:{})'.format(r.pattern) for r in regexes)
+    try:
+        return re.compile('|'.join(alternatives), flags)
+    except re.error:
+        # Such as inline global flags, which must start the whole pattern
+        return None
+
+
+def _escape_template(new):
+    return new.replace('\\', r'\\')
+
+
+def _sub_chunks(chunks, regex, template, width):
+    '''
+    Yield chunks of text with each match of ``regex`` replaced by
+    ``template``. The last ``width`` characters of each chunk, plus one
+    for context, are kept for the next, so that matches of up to
+    ``width`` characters are found across chunk boundaries.
+    '''
+    literal = '\\' not in template
+    head = ''
+    carry = ''
+    chunks = iter(chunks)
+    done = False
+    while not done:
+        chunk = next(chunks, None)
+        done = chunk is None
+        buf = head + carry + (chunk or '')
+        start = len(head)
+        cut = len(buf) if done else len(buf) - width
+        if cut <= start and not done:
+            carry = buf[start:]
+            continue
+
+        out = []
+        pos = start
+        for m in regex.finditer(buf, start):
+            if m.start() >= cut and not done:
+                break
+
+            out.append(buf[pos:m.start()])
+            out.append(template if literal else m.expand(template))
+            pos = m.end()
+
+        if pos < cut:
+            out.append(buf[pos:cut])
+            pos = cut
+
+        head = buf[pos - 1:pos]
+        carry = buf[pos:]
+        text = ''.join(out)
+        if text:
+            yield text
+
+
+def _strip_chunks(chunks, chars=None):
+    '''
+    Yield chunks of text with leading and trailing ``chars`` removed from
+    the text as a whole.
+    '''
+    pending = ''
+    started = False
+    for chunk in chunks:
+        if not started:
+            chunk = chunk.lstrip(chars)
+            started = bool(chunk)
+
+        body = chunk.rstrip(chars)
+        if body:
+            yield pending + body
+            pending = chunk[len(body):]
+        else:
+            pending += chunk
+
+
+def _replace_lines(lines, patterns, new, strip=False, window=4096):
+    '''
+    Replace ``patterns`` in a stream of lines a chunk at a time, as for
+    ``replace_all``, returning the new lines. Strings are found across
+    chunks, and regex matches if they span at most ``window`` characters.
+    '''
+    patterns = [p if utils.is_regex(p) else str(p) for p in patterns]
+    new = str(new)
+    stages = []
+    compiled = None
+    if not ('\\' in new and any(map(utils.is_regex, patterns))):
+        compiled = compile_each(tuple(patterns))
+
+    if compiled is not None:
+        stages.append((compiled, _escape_template(new), patterns))
+    else:
+        for pattern in patterns:
+            if utils.is_regex(pattern):
+                stages.append((pattern, new, [pattern]))
+            else:
+                regex = re.compile(re.escape(pattern))
+                stages.append((regex, _escape_template(new), [pattern]))
+
+    chunks = lines.iter_chunks()
+    for regex, template, group in stages:
+        width = max(
+            window if utils.is_regex(p) else len(p) - 1 for p in group
+        )
+        chunks = _sub_chunks(chunks, regex, template, width)
+        if strip:
+            chunks = _strip_chunks(chunks, None if strip is True else strip)
+
+    return utils.iter_lines(chunks)
+
+
+def replace_all(text, patterns, new, count=None, strip=False):
+    '''
+    Replace every occurrence of each of ``patterns`` in ``text`` with
+    ``new``, in a single pass. Replacements are not searched again, and
+    where patterns overlap, the first and longest match is replaced.
+
+    With a ``count`` per pattern, or regexes that cannot be combined,
+    each pattern is replaced in turn instead, as for ``strutil``.
+    '''
+    patterns = [p if utils.is_regex(p) else str(p) for p in patterns]
+    new = str(new)
+    compiled = None
+    if count is None and not (
+        '\\' in new and any(map(utils.is_regex, patterns))
+    ):
+        compiled = compile_each(tuple(patterns))
+
+    if compiled is None:
+        items = [(pattern, new) for pattern in patterns]
+        return strutil.replace_each(text, items, count=count, strip=strip)
+
+    text = compiled.sub(_escape_template(new), text)
+    if strip:
+        text = text.strip(None if strip is True else strip)
+
+    return text
+
+
+def _replace_each(all_data, patterns, new, kws):
+    results = []
+    for data in all_data:
+        if isinstance(data, LineStream):
+            if kws.get('count') is not None:
+                raise ValueError('count is not supported for streams')
+
+            results.append(data.pipe(
+                _replace_lines,
+                patterns,
+                new,
+                kws.get('strip', False),
+                kws.get('window', 4096)
+            ))
+        else:
+            results.append(DataProxy(replace_all(
+                str(data),
+                patterns,
+                new,
+                kws.get('count'),
+                kws.get('strip', False)
+            )))
+
+    return results
 
 
 @register
-def remove_each(data, args, kws):
-    data = str(data)
-    for arg in args:
-        data = strutil.remove_each(data, arg, **kws)
+def remove_each(all_data, args, kws):
+    '''
+    Remove all occurrences of each of args, in a single pass.
 
-    return DataProxy(data)
+    Streamed lines are rewritten a chunk at a time; a regex is found
+    across chunks if its matches are at most ``window`` (4096) characters.
+    '''
+    return _replace_each(all_data, args, '', kws)
 
 
 @register
-def replace_each(data, args, kws):
+def replace_each(all_data, args, kws):
     '''
-    Use arg[0] as a replacement for all args[1:]
+    Use arg[0] as a replacement for all args[1:], in a single pass.
+
+    Streamed lines are rewritten as for ``remove_each``.
     '''
-    replacement = args[0]
-    data = strutil.replace_each(
-        str(data),
-        [(arg, replacement) for arg in args[1:]],
-        **kws
-    )
+    return _replace_each(all_data, args[1:], args[0], kws)
+
+
+def _compress_lines(lines):
+    for line in lines:
+        words = line.split()
+        if words:
+            yield ' '.join(words)
 
-    return DataProxy(data)
+
+def _compress_text(text):
+    return '\n'.join(_compress_lines(utils.iter_lines(utils.iter_chunks(text))))
 
 
 @register
-def compress_text(data, args, kws):
-    lines = str(data).splitlines()
-    return DataProxy('\n'.join(' '.join(
-        l.strip() for l in line.split()) for line in lines if line.strip()
-    ))
+def compress_text(all_data, args, kws):
+    '''
+    Collapse runs of whitespace within each line and drop blank lines,
+    lazily for streamed lines.
+    '''
+    return [
+        data.pipe(_compress_lines) if isinstance(data, LineStream)
+        else DataProxy(_compress_text(str(data)))
+        for data in all_data
+    ]
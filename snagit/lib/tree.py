@@ -0,0 +1,293 @@
+'''
+Document type backed directly by lxml elements.
+
+Unlike ``Soup``, a ``Tree`` keeps no Python object per node: selection,
+extraction and text retrieval run in lxml's C code, which makes it the
+cheaper choice for large volume extraction. Convert with the ``tree`` and
+``parse`` commands.
+'''
+import re
+import logging
+import functools
+from copy import deepcopy
+
+from . import DataProxy, library
+from .soup import Soup, parse_simple_selector
+
+try:
+    from lxml import etree
+    import lxml.html
+except ImportError:
+    etree = None
+
+try:
+    from lxml.cssselect import CSSSelector
+except ImportError:
+    CSSSelector = None
+
+logger = logging.getLogger(__name__)
+register = library.register('Tree')
+document_re = re.compile(r'\s*(<\?[^>]*>\s*)?(<!doctype|<html)', re.I)
+xpath_prefixes = ('/', './', '(')
+
+
+def parse_tree(text):
+    '''
+    Parse ``text`` into a list of lxml elements: a single root for a full
+    document, otherwise the top level fragments, preceded by any leading
+    text as a string.
+    '''
+    if etree is None:
+        raise ValueError('Tree documents require lxml')
+
+    if not text.strip():
+        return []
+
+    if document_re.match(text):
+        return [lxml.html.document_fromstring(text)]
+
+    return [
+        item if isinstance(item, str) else deepcopy(item)
+        for item in lxml.html.fragments_fromstring(text)
+    ]
+
+
+@functools.lru_cache(maxsize=512)
+def compile_xpath(expr):
+    return etree.XPath(expr, smart_strings=False)
+
+
+def css_to_xpath(selector):
+    '''
+    Translate a simple selector, of ``tag.class#id`` compounds joined by
+    descendant or child combinators, to XPath. Returns ``None`` for
+    anything else.
+    '''
+    compounds = parse_simple_selector(selector)
+    if compounds is None:
+        return None
+
+    steps = []
+    for combinator, name, id_, classes in compounds:
+        if not steps:
+            step = 'descendant-or-self::'
+        else:
+            step = '/' if combinator == '>' else '/descendant::'
+
+        step += name or '*'
+        if id_:
+            step += '[@id="{}"]'.format(id_)
+
+        for cls in classes:
+            step += (
+                '[contains(concat(" ", normalize-space(@class), " "), " {} ")]'
+            ).format(cls)
+
+        steps.append(step)
+
+    return ''.join(steps)
+
+
+@functools.lru_cache(maxsize=512)
+def compile_css(selector):
+    '''
+    Compile a CSS ``selector`` with lxml's ``cssselect`` support if it is
+    installed, otherwise only simple selectors are supported.
+    '''
+    if CSSSelector is not None:
+        return CSSSelector(selector, translator='html')
+
+    expr = css_to_xpath(selector)
+    if expr is None:
+        raise ValueError(
+            'Selector requires the cssselect package: {}'.format(selector)
+        )
+
+    return compile_xpath(expr)
+
+
+def compile_selector(selector):
+    '''
+    Compile ``selector`` as XPath when it starts with ``/``, ``./`` or
+    ``(``, otherwise as CSS.
+    '''
+    if selector.startswith(xpath_prefixes):
+        return compile_xpath(selector)
+
+    return compile_css(selector)
+
+
+def detach(item):
+    '''
+    Copy a selection result into a root of its own, without its tail text.
+    '''
+    if isinstance(item, bool):
+        return str(item).lower()
+
+    if not etree.iselement(item):
+        return str(item)
+
+    item = deepcopy(item)
+    item.tail = None
+    return item
+
+
+def render(item):
+    if isinstance(item, str):
+        return item
+
+    return etree.tostring(item, encoding='unicode', method='html')
+
+
+class Tree(DataProxy):
+    '''
+    A list of lxml elements, with strings for text results, rendered one
+    per line. A ``Tree`` is copied before a command changes it, unless it
+    was released.
+    '''
+
+    __slots__ = ('_shared',)
+
+    def __init__(self, data):
+        self._shared = True
+        if isinstance(data, Tree):
+            if data._shared:
+                self._data = [
+                    item if isinstance(item, str) else deepcopy(item)
+                    for item in data._data
+                ]
+            else:
+                data._shared = True
+                self._data = data._data
+        elif isinstance(data, Soup):
+            self._data = parse_tree(str(data._data))
+        else:
+            self._data = parse_tree(str(data))
+
+    @classmethod
+    def wrap(cls, items):
+        '''
+        Create a ``Tree`` from a list of items, without copying them.
+        '''
+        self = cls.__new__(cls)
+        self._data = items
+        self._shared = True
+        return self
+
+    def __str__(self):
+        return '\n'.join(render(item) for item in self._data)
+
+    def __reduce__(self):
+        return (self.__class__, (str(self),))
+
+    def release(self):
+        self._shared = False
+
+    @property
+    def elements(self):
+        return [item for item in self._data if not isinstance(item, str)]
+
+    def select(self, selector, xpath=False):
+        '''
+        Return the results of ``selector``, for each element in turn. It is
+        compiled as XPath if ``xpath`` is set, otherwise as for
+        ``compile_selector``.
+        '''
+        if xpath:
+            compiled = compile_xpath(selector)
+        else:
+            compiled = compile_selector(selector)
+
+        results = []
+        for el in self.elements:
+            found = compiled(el)
+            if isinstance(found, list):
+                results.extend(found)
+            else:
+                results.append(found)
+
+        return results
+
+    @classmethod
+    def merge(cls, all_data):
+        items = []
+        for tree in all_data:
+            items.extend(Tree(tree)._data)
+
+        return cls.wrap(items)
+
+
+def _select(data, selector, xpath=False):
+    tree = data if isinstance(data, Tree) else Tree(data)
+    return Tree.wrap([
+        detach(item) for item in tree.select(selector, xpath=xpath)
+    ])
+
+
+@register
+def tree(data, args, kws):
+    '''
+    Parse the content with lxml, or convert a soup to a tree.
+    '''
+    return data if isinstance(data, Tree) else Tree(data)
+
+
+@register
+def xpath(data, args, kws):
+    '''
+    Select the results of an XPath expression. Elements and strings are
+    kept, while other results are converted to strings.
+    '''
+    return _select(data, args[0], xpath=True)
+
+
+@register
+def css(data, args, kws):
+    '''
+    Select elements matching a CSS selector. Without the cssselect package,
+    only ``tag.class#id`` compounds joined by descendant or child (``>``)
+    combinators are supported.
+    '''
+    return _select(data, args[0] if args else '*')
+
+
+@register
+def text(data, args, kws):
+    '''
+    Retrieve the text of each element of a tree, one per line.
+    '''
+    tree = data if isinstance(data, Tree) else Tree(data)
+    return '\n'.join(
+        item if isinstance(item, str) else item.text_content()
+        for item in tree._data
+    )
+
+
+def drop(data, args, kws):
+    '''
+    Remove the elements matching each selector from a tree, keeping the
+    text that follows them.
+    '''
+    tree = Tree(data)
+    for selector in args:
+        roots = set()
+        for match in tree.select(selector):
+            if not etree.iselement(match):
+                continue
+
+            if match.getparent() is None:
+                roots.add(id(match))
+            else:
+                match.drop_tree()
+
+        if roots:
+            items = []
+            for item in tree._data:
+                if id(item) not in roots:
+                    items.append(item)
+                elif item.tail:
+                    items.append(item.tail)
+
+            tree._data = items
+
+    return tree
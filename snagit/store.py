@@ -0,0 +1,141 @@
+'''
+Temporary on-disk storage for documents evicted from memory, and for the
+runs of an external sort.
+'''
+import sys
+import mmap
+import heapq
+import pickle
+import tempfile
+from itertools import islice
+
+
+class Spilled:
+    '''
+    Placeholder for a document that has been written to a ``SpillStore``.
+    '''
+
+    __slots__ = ('offset', 'length')
+
+    def __init__(self, offset, length):
+        self.offset = offset
+        self.length = length
+
+
+class SpillStore:
+    '''
+    An append-only temporary file of pickled documents, read back through a
+    memory map.
+    '''
+
+    def __init__(self, dir=None):
+        self.fp = tempfile.TemporaryFile(dir=dir)
+        self.size = 0
+        self.map = None
+
+    def spill(self, data):
+        payload = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+        self.fp.seek(self.size)
+        self.fp.write(payload)
+        spilled = Spilled(self.size, len(payload))
+        self.size += len(payload)
+        return spilled
+
+    def load(self, item):
+        if not isinstance(item, Spilled):
+            return item
+
+        end = item.offset + item.length
+        if self.map is None or len(self.map) < end:
+            self.fp.flush()
+            if self.map is not None:
+                self.map.close()
+
+            self.map = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return pickle.loads(self.map[item.offset:end])
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+        self.fp.close()
+
+
+def _write_run(items, dir=None, block=1024):
+    fp = tempfile.TemporaryFile(dir=dir)
+    items = iter(items)
+    for chunk in iter(lambda: list(islice(items, block)), []):
+        pickle.dump(chunk, fp, pickle.HIGHEST_PROTOCOL)
+
+    fp.seek(0)
+    return fp
+
+
+def _read_run(fp):
+    with fp:
+        while True:
+            try:
+                block = pickle.load(fp)
+            except EOFError:
+                return
+
+            yield from block
+
+
+def external_sort(
+    items,
+    key=None,
+    reverse=False,
+    memory=2 ** 26,
+    dir=None,
+    width=16
+):
+    '''
+    Yield ``items`` in sorted order, as for ``sorted``. Whenever about
+    ``memory`` bytes of items are buffered, they are sorted and spilled to
+    a temporary file as a run, and the runs are merged as they are read
+    back.
+
+    Each run keeps its temporary file open, so runs are merged in passes of
+    ``width``: once there are ``width`` runs of the same level, they are
+    merged into a single run of the next level. The number of open files
+    only grows with the logarithm of the number of runs.
+    '''
+    def merge(runs):
+        return heapq.merge(*runs, key=key, reverse=reverse)
+
+    # Runs by level, where merged runs move up a level, so that each level
+    # holds items from before those of the levels below
+    levels = []
+    buf = []
+    size = 0
+    for item in items:
+        buf.append(item)
+        size += sys.getsizeof(item) + 8
+        if size < memory:
+            continue
+
+        buf.sort(key=key, reverse=reverse)
+        run = _read_run(_write_run(buf, dir))
+        buf = []
+        size = 0
+        for runs in levels:
+            runs.append(run)
+            if len(runs) < width:
+                break
+
+            run = _read_run(_write_run(merge(runs), dir))
+            del runs[:]
+        else:
+            levels.append([run])
+
+    buf.sort(key=key, reverse=reverse)
+    runs = [run for runs in reversed(levels) for run in runs]
+    if not runs:
+        yield from buf
+        return
+
+    # The buffer is merged last, keeping the sort stable
+    yield from merge(runs + [buf])
@@ -1,8 +1,14 @@
+import os
 import re
+import sys
+import gzip
+import math
 import random
+import hashlib
 import logging
 import importlib
 from pathlib import Path
+from urllib.parse import urlparse
 from copy import deepcopy
 from strutil import is_string, is_regex
 
@@ -55,9 +61,12 @@ DEFAULT_CONFIG = {
     ),
     'bad_tags': BAD_TAGS,
     'bad_attrs': BAD_ATTRS,
+    'global_attrs': GLOBAL_ATTRS,
     'non_closing_tags': 'hr br link meta img base input param source'.split(),
     'no_indent_tags': 'body head tr'.split(),
-    'parser': 'html.parser'
+    'parser': 'html.parser',
+    'parallel_size': 256 * 1024 ** 2,
+    'sort_memory': 64 * 1024 ** 2
 }
 
 _config_settings = deepcopy(DEFAULT_CONFIG)
@@ -78,6 +87,262 @@ def normalize_search_attrs(attrs):
     )
 
 
+size_re = re.compile(r'^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?\s*$', re.IGNORECASE)
+
+
+def parse_size(size):
+    '''
+    Convert a size such as ``'2G'``, ``'512k'`` or ``1024`` to bytes. In
+    scripts, sizes with units must be quoted, as in ``memory='64M'``.
+    '''
+    if isinstance(size, int):
+        return size
+
+    m = size_re.match(size)
+    if not m:
+        raise ValueError('Invalid size: {}'.format(size))
+
+    num, unit = m.groups()
+    return int(float(num) * 1024 ** 'bkmgt'.index(unit.lower() or 'b'))
+
+
+def check_args(name, args, count=0):
+    '''
+    Raise ``ValueError`` if the command ``name`` is given more than
+    ``count`` arguments, as when an unquoted size such as ``memory=64M``
+    is read as ``memory=64`` and a stray ``M``.
+    '''
+    if len(args) > count:
+        extra = ' '.join(str(arg) for arg in args[count:])
+        raise ValueError('Unexpected arguments to {}: {} (quote sizes)'.format(
+            name,
+            extra
+        ))
+
+
+def iter_chunks(data, size=2 ** 16):
+    '''
+    Yield the text of ``data`` in chunks of at most ``size`` characters,
+    reading streamed documents as they go.
+    '''
+    if hasattr(data, 'iter_chunks'):
+        yield from data.iter_chunks(size)
+        return
+
+    text = str(data)
+    for i in range(0, len(text), size):
+        yield text[i:i + size]
+
+
+def trie_regex(words):
+    '''
+    Return a regex pattern matching any of the literal ``words``, built
+    from a trie of the words so that common prefixes are only tried once.
+    '''
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None
+
+    def build(node):
+        alternatives = []
+        chars = []
+        for char in sorted(key for key in node if key):
+            rest = build(node[char])
+            if rest:
+                alternatives.append(re.escape(char) + rest)
+            else:
+                chars.append(re.escape(char))
+
+        if chars:
+            alternatives.append(
+                chars[0] if len(chars) == 1 else '[{}]'.format(''.join(chars))
+            )
+
+        if not alternatives:
+            return ''
+
+        if len(alternatives) == 1 and (chars or '' not in node):
+            pattern = alternatives[0]
+        else:
+            pattern = '(?:{})'.format('|'.join(alternatives))
+
+        return pattern + '?' if '' in node else pattern
+
+    return build(trie)
+
+
+backref_re = re.compile(r'\\\d|\(\?P[<=]')
+
+
+class Matcher:
+    '''
+    Match lines against many patterns at once, as ``strutil.matches`` does
+    for one: a string matches a line containing it, and a regex one that
+    it matches at the start.
+
+    All strings are compiled into a single trie based regex, and regexes
+    are combined into a single alternation where possible. With ``mode``
+    of ``'any'``, ``'all'`` or ``'none'``, a line matches if any, all or
+    none of the patterns do; ``invert`` reverses the result.
+    '''
+
+    modes = ('any', 'all', 'none')
+
+    def __init__(self, patterns, mode='any', invert=False):
+        if mode not in self.modes:
+            raise ValueError('Invalid match mode: {}'.format(mode))
+
+        self.mode = mode
+        self.invert = bool(invert)
+        self.regexes = [p for p in patterns if is_regex(p)]
+        self.strings = list(dict.fromkeys(
+            str(p) for p in patterns if not is_regex(p)
+        ))
+        self.strings_re = None
+        if self.strings:
+            self.strings_re = re.compile(trie_regex(self.strings))
+
+        self.regex = None
+        flags = set(r.flags for r in self.regexes)
+        if len(self.regexes) > 1 and len(flags) == 1 and not any(
+            backref_re.search(r.pattern) for r in self.regexes
+        ):
+            try:
+                self.regex = re.compile(
+                    '|'.join('(?:{})'.format(r.pattern) for r in self.regexes),
+                    flags.pop()
+                )
+            except re.error:
+                # Such as inline global flags, which must start the whole
+                # pattern; each regex is then matched in turn
+                pass
+        elif len(self.regexes) == 1:
+            self.regex = self.regexes[0]
+
+    @property
+    def string(self):
+        '''
+        The only pattern, if it is a string matched normally, else ``None``.
+        '''
+        if (
+            self.mode == 'any' and not self.invert and
+            not self.regexes and len(self.strings) == 1
+        ):
+            return self.strings[0]
+
+    @property
+    def searchable(self):
+        '''
+        Whether a line matches exactly when ``strings_re`` finds a match in
+        it, so that text can be searched as a whole.
+        '''
+        return (
+            self.mode == 'any' and not self.invert and not self.regexes and
+            self.strings_re is not None
+        )
+
+    def any(self, line):
+        if self.strings_re is not None and self.strings_re.search(line):
+            return True
+
+        if self.regex is not None:
+            return self.regex.match(line) is not None
+
+        return any(r.match(line) for r in self.regexes)
+
+    def all(self, line):
+        return (
+            all(s in line for s in self.strings) and
+            all(r.match(line) for r in self.regexes)
+        )
+
+    def __call__(self, line):
+        if self.mode == 'all':
+            found = self.all(line)
+        else:
+            found = self.any(line) == (self.mode == 'any')
+
+        return found != self.invert
+
+    def __repr__(self):
+        return 'Matcher({!r}, mode={!r}, invert={!r})'.format(
+            self.strings + self.regexes, self.mode, self.invert
+        )
+
+
+class BloomFilter:
+    '''
+    An approximate set of strings in a fixed number of bits. Membership may
+    be reported falsely, at a rate of about ``error`` while it holds at most
+    ``capacity`` items, but never missed.
+    '''
+
+    def __init__(self, capacity, error=0.001):
+        self.size = max(8, math.ceil(
+            -capacity * math.log(error) / math.log(2) ** 2
+        ))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(
+            item.encode('utf8', 'surrogatepass'),
+            digest_size=16
+        ).digest()
+        pos = int.from_bytes(digest[:8], 'little')
+        step = int.from_bytes(digest[8:], 'little') | 1
+        size = self.size
+        return [(pos + i * step) % size for i in range(self.hashes)]
+
+    def __contains__(self, item):
+        bits = self.bits
+        return all(
+            bits[pos >> 3] >> (pos & 7) & 1
+            for pos in self._positions(item)
+        )
+
+    def add(self, item):
+        '''
+        Add ``item``, returning ``False`` if it was possibly added before.
+        '''
+        bits = self.bits
+        added = False
+        for pos in self._positions(item):
+            byte = bits[pos >> 3]
+            if not byte >> (pos & 7) & 1:
+                bits[pos >> 3] = byte | 1 << (pos & 7)
+                added = True
+
+        return added
+
+
+LINE_BREAKS = '\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+
+def iter_lines(chunks):
+    '''
+    Yield the lines of text given as an iterable of chunks, split as by
+    ``str.splitlines``, keeping only a partial line between chunks.
+    '''
+    carry = ''
+    for chunk in chunks:
+        lines = (carry + chunk).splitlines(True)
+        carry = lines.pop() if lines else ''
+        # A trailing \r may be the first half of a \r\n
+        if carry.endswith(tuple(LINE_BREAKS.replace('\r', ''))):
+            lines.append(carry)
+            carry = ''
+
+        for line in lines:
+            yield line.rstrip(LINE_BREAKS)
+
+    if carry:
+        yield carry.rstrip(LINE_BREAKS)
+
+
 def set_config(**kws):
     global _config_settings
     new_config = deepcopy(_config_settings)
@@ -90,25 +355,59 @@ def get_config(key=None, default=None):
     return _config_settings.get(key, default) if key else _config_settings
 
 
-def read_url(url):
-    '''
-    Read data from ``url``.
-
-    Returns a 2-tuple of (text, content_type)
-    '''
+def _get_url(url, **kws):
     ua = get_config('user_agents')
     headers = {'accept-language': 'en-US,en'}
     if ua:
         headers['User-Agent'] = random.choice(ua)
 
-    r = requests.get(url, headers=headers)
+    r = requests.get(url, headers=headers, **kws)
     if not r.ok:
         raise requests.HTTPError('URL {}: {}'.format(r.reason, url))
 
+    return r
+
+
+def read_url(url):
+    '''
+    Read data from ``url``.
+
+    Returns a 2-tuple of (text, content_type)
+    '''
+    r = _get_url(url)
     ct = r.headers.get('content-type')
     return (r.text, ct)
 
 
+def local_filename(source):
+    '''
+    Return the absolute filename for a local file ``source``, or ``None``
+    for a URL.
+    '''
+    purl = urlparse(source)
+    if purl.scheme.lower() in ('file', ''):
+        return absolute_filename(purl.path)
+
+
+def iter_source(source, size=2 ** 16, encoding='utf8'):
+    '''
+    Yield the text of a file or URL ``source`` in chunks, without reading
+    it all into memory. The cache is not used.
+    '''
+    filename = local_filename(source)
+    if filename:
+        with open(filename, encoding=encoding, newline='') as fp:
+            yield from iter(lambda: fp.read(size), '')
+    else:
+        with _get_url(source, stream=True) as r:
+            r.encoding = r.encoding or encoding
+            yield from r.iter_content(size, decode_unicode=True)
+
+
+def iter_source_lines(source, encoding='utf8'):
+    return iter_lines(iter_source(source, encoding=encoding))
+
+
 def absolute_filename(filename):
     '''
     Do all those annoying things to arrive at a real absolute path.
@@ -125,6 +424,193 @@ def write_file(filename, data, mode='w', encoding='utf8'):
         fp.write(data)
 
 
+def rotated_filename(filename, index):
+    '''
+    Number ``filename`` before its extensions, as ``out.1.txt.gz``.
+    '''
+    path = Path(filename)
+    stem, dot, ext = path.name.partition('.')
+    return str(path.with_name('{}.{}{}{}'.format(stem, index, dot, ext)))
+
+
+def last_rotated_index(filename):
+    '''
+    Return the highest number of an existing file numbered as for
+    ``rotated_filename``, or 0 if there is none.
+    '''
+    path = Path(filename)
+    stem, dot, ext = path.name.partition('.')
+    name_re = re.compile(r'{}\.(\d+){}$'.format(
+        re.escape(stem),
+        re.escape(dot + ext)
+    ))
+    indexes = [0]
+    if path.parent.is_dir():
+        for other in path.parent.iterdir():
+            m = name_re.match(other.name)
+            if m:
+                indexes.append(int(m.group(1)))
+
+    return max(indexes)
+
+
+class LazyFile:
+    '''
+    A write-only, file-like object that only creates ``filename`` on the
+    first non-empty write. With no ``filename``, writes go to stdout.
+
+    The file is gzip compressed with ``compress=True``, or by default for
+    a ``.gz`` filename, and appended to with ``append=True``. With
+    ``rotate_size`` characters or ``rotate_count`` documents, output moves
+    to a new file, numbered as for ``rotated_filename``, at the first
+    document past either limit. When appending, rotation resumes after the
+    last existing numbered file, or within it if only ``rotate_size`` is
+    given and it is not yet full.
+    '''
+
+    def __init__(
+        self,
+        filename=None,
+        mode='w',
+        encoding='utf8',
+        compress=None,
+        append=False,
+        rotate_size=None,
+        rotate_count=None
+    ):
+        self.filename = filename
+        self.mode = 'a' if append else mode
+        self.encoding = encoding
+        if compress is None:
+            compress = str(filename or '').endswith('.gz')
+
+        self.compress = compress
+        self.rotate_size = parse_size(rotate_size) if rotate_size else None
+        self.rotate_count = rotate_count
+        self.fp = None if filename else sys.stdout
+        self.path = None
+        self.index = None
+        self.count = 0
+        self.filenames = []
+        self.size = 0
+        self.documents = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def rotating(self):
+        return bool(self.filename and (self.rotate_size or self.rotate_count))
+
+    def _existing_size(self, path):
+        if not os.path.exists(path):
+            return 0
+
+        if not self.compress:
+            return os.path.getsize(path)
+
+        size = 0
+        with gzip.open(path, 'rt', encoding=self.encoding) as fp:
+            for chunk in iter(lambda: fp.read(2 ** 16), ''):
+                size += len(chunk)
+
+        return size
+
+    def _choose_path(self):
+        '''
+        Pick the file the next document goes to, along with its existing
+        size when appending.
+        '''
+        if not self.rotating:
+            self.path = absolute_filename(self.filename)
+        else:
+            if self.index is None:
+                self.index = 0
+                if self.mode == 'a':
+                    self.index = last_rotated_index(self.filename)
+                    path = rotated_filename(self.filename, self.index)
+                    if not self.index or self.rotate_count or (
+                        self._existing_size(path) >= self.rotate_size
+                    ):
+                        self.index += 1
+                else:
+                    self.index = 1
+            else:
+                self.index += 1
+
+            self.path = absolute_filename(
+                rotated_filename(self.filename, self.index)
+            )
+
+        self.size = self._existing_size(self.path) if self.mode == 'a' else 0
+        self.documents = 0
+
+    def next_document(self):
+        '''
+        Start a new document, first closing the current file if it is full.
+        Returns the separator to write before the document: a newline if
+        the file already has content.
+        '''
+        if self.filename:
+            full = self.rotating and self.documents and (
+                (self.rotate_count and self.documents >= self.rotate_count) or
+                (self.rotate_size and self.size >= self.rotate_size)
+            )
+            if full:
+                self.close()
+                self.path = None
+
+            if self.path is None:
+                self._choose_path()
+
+        sep = '\n' if self.documents or self.size else ''
+        self.documents += 1
+        return sep
+
+    def open(self):
+        '''
+        Create, or truncate, the file now rather than on the first write.
+        '''
+        if self.filename and self.fp is None:
+            self.fp = self._open()
+
+        return self
+
+    def _open(self):
+        if self.path is None:
+            self._choose_path()
+
+        self.filenames.append(self.path)
+        if self.compress:
+            return gzip.open(
+                self.path,
+                self.mode + 't',
+                compresslevel=6,
+                encoding=self.encoding
+            )
+
+        return open(self.path, self.mode, encoding=self.encoding)
+
+    def write(self, data):
+        if not data:
+            return
+
+        if self.fp is None:
+            self.fp = self._open()
+
+        self.fp.write(data)
+        self.count += len(data)
+        self.size += len(data)
+
+    def close(self):
+        if self.filename and self.fp is not None:
+            self.fp.close()
+            self.fp = None
+
+
 def read_file(filename, encoding='utf8'):
     '''
     Read ``data`` from properly encoded file.
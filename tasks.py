@@ -1,4 +1,5 @@
 import os
+import glob
 from invoke import task
 
 @task
@@ -24,6 +25,14 @@ def test(ctx, filename=''):
     )
 
 
+@task
+def bench(ctx, name='*'):
+    '''Run the benchmark scripts'''
+    for script in sorted(glob.glob('benchmarks/bench_{}.py'.format(name))):
+        print('>>> {}'.format(script))
+        ctx.run('python {}'.format(script), pty=True)
+
+
 @task
 def cov(ctx):
     '''Open the coverage reports'''
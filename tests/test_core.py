@@ -74,6 +74,17 @@ class TestParse:
             {'g-1': 123, 'i': 'a,b,c', 'j': regex(',"a"')}
         )
 
+    def test_long_line(self):
+        terms = ['t{}'.format(i) for i in range(5000)]
+        self._assert_instruction(
+            "replace_each _ {} ,x, 12ab j'[1, {{\"a\": 2}}]' n=3".format(
+                ' '.join(terms)
+            ),
+            'replace_each',
+            ['_'] + terms + ['x', 12, 'ab', [1, {'a': 2}]],
+            {'n': 3}
+        )
+
 
 
 def read_test_data(basename):
@@ -162,6 +173,197 @@ class TestProgram:
         assert "Hello, world" == execute_script('tests/script.snagit', 'Hello, world#')
 
 
+class TestContents:
+
+    def test_dispatch(self, monkeypatch):
+        from snagit.core import Contents
+        from snagit.lib import library
+
+        # Keep the test commands out of the shared registry
+        monkeypatch.setattr(library, 'registry', dict(library.registry))
+        calls = []
+
+        @library.register('Test')
+        def per_document(data, args, kws):
+            calls.append(data)
+            return data
+
+        @library.register('Test', batch=True)
+        def per_batch(all_data, args, kws):
+            calls.append(list(all_data))
+            return []
+
+        contents = Contents('a b c'.split())
+        contents(per_document, [], {})
+        assert len(calls) == 3
+        assert str(contents) == 'a\nb\nc'
+
+        del calls[:]
+        contents(per_batch, [], {})
+        assert len(calls) == 1 and len(calls[0]) == 3
+        assert len(contents) == 0
+
+    def test_spill(self):
+        from snagit.store import Spilled
+        docs = ['<p>{}</p>'.format(i) for i in range(20)]
+        interp = Interpreter(docs, max_memory=40)
+        interp.execute('select p\nunwrap p')
+        contents = interp.contents
+        assert contents.resident <= 40
+        assert any(isinstance(ct, Spilled) for ct in contents.stack[0])
+        assert str(contents) == '\n'.join(str(i) for i in range(20))
+
+        interp.execute('end')
+        assert str(contents) == '\n'.join(docs)
+
+        # Spilled documents keep their trees, down to adjacent strings
+        docs = ['<p class="x">{} <b>bold</b></p>'.format(i) for i in range(5)]
+        for script in ['select p', 'unwrap b', 'index', 'select p.x', 'end']:
+            spilled = Interpreter(docs, max_memory=10)
+            plain = Interpreter(docs)
+            for interp in (spilled, plain):
+                interp.execute('select p\nunwrap b\n' + script)
+
+            assert str(spilled.contents) == str(plain.contents)
+
+    def test_history(self):
+        docs = ['<p>{}</p><i>-</i>'.format(i) for i in range(5)]
+        expect = execute_code('select p\nmerge\nunwrap p', docs)
+        interp = Interpreter(docs, history=False)
+        interp.execute('select p\nmerge\nunwrap p')
+        assert str(interp.contents) == expect
+        assert interp.contents.stack == []
+
+        interp = Interpreter(docs)
+        interp.execute('history False\nselect p\nend')
+        assert str(interp.contents) == '\n'.join(
+            '<p>{}</p>'.format(i) for i in range(5)
+        )
+
+    def test_stream(self, tmp_path):
+        import io
+        import pickle
+        from snagit.lib.lines import LineStream
+        text = 'a\r\nfoo 1\n  bar\x0cbaz\n\nfoo 2\nend\nafter'
+        filename = tmp_path / 'stream.txt'
+        filename.write_bytes(text.encode())
+        for script in [
+            'lines', 'strip\nmatches r"b"', 'skip_to foo keep=True',
+            'skip_to nope', 'sort reverse=True memory=20\nuniq', 'count',
+            'dedupe', 'read_until end\nformat "{1}: {0}"'
+        ]:
+            interp = Interpreter()
+            interp.execute('load {} stream=True\n{}'.format(filename, script))
+            data = interp.contents.contents[0]
+            assert isinstance(data, LineStream) == (script != 'lines')
+            assert str(interp.contents) == execute_code(script, text)
+
+        data = pickle.loads(pickle.dumps(data))
+        fp = io.StringIO()
+        data.write(fp)
+        assert fp.getvalue() == '1: a\n2: foo 1\n3:   bar\n4: baz\n5: \n6: foo 2'
+
+    def test_stream_text(self, tmp_path):
+        from snagit.lib.lines import LineStream
+        text = ''.join(
+            ' {}  item\t{}\n\n'.format('foo' if i % 3 else 'bar', i)
+            for i in range(20000)
+        )
+        filename = tmp_path / 'text.txt'
+        filename.write_text(text)
+        for script in [
+            r'replace_each # foo r"item\s+\d+5\n"', r'remove_each "\n\n b"',
+            'compress_text', 'remove_each foo strip=True',
+        ]:
+            interp = Interpreter()
+            interp.execute('load {} stream=True\n{}'.format(filename, script))
+            assert isinstance(interp.contents.contents[0], LineStream)
+            assert str(interp.contents) == execute_code(script, text).rstrip(
+                '\n'
+            )
+
+    def test_parallel_matches(self, tmp_path):
+        from snagit.lib.lines import newline_chunks, _grep_chunk_count
+        assert _grep_chunk_count(1000, 4) == 1
+        assert _grep_chunk_count(100 << 20, 8) == 32
+        assert _grep_chunk_count(10 << 30, 2) == 160
+        text = ''.join('{} line {}\n'.format(i % 7, i) for i in range(500))
+        filename = tmp_path / 'grep.txt'
+        filename.write_text(text + 'no newline 3')
+        chunks = newline_chunks(str(filename), 4)
+        assert len(chunks) == 4 and chunks[-1][1] == filename.stat().st_size
+        for script in ['matches 3', r'matches r"^[25] " invert=True']:
+            interp = Interpreter()
+            interp.execute('load {} stream=True\n{} jobs=2'.format(
+                filename, script
+            ))
+            assert str(interp.contents) == execute_code(
+                script, text + 'no newline 3'
+            )
+
+
+class TestMain:
+
+    def test_output(self, tmp_path, capsys):
+        from snagit.__main__ import run_program
+        out = tmp_path / 'out.txt'
+        run_program(['--exec', 'strip', '-s', 'tests/script.snagit', '-o', str(out)])
+        assert out.read_text() == 'replace_each "" #'
+
+        run_program(['--exec', 'select li', '-s', 'tests/some.html', '--raw'])
+        assert capsys.readouterr().out.startswith('<li class="abc"><a')
+
+        empty = tmp_path / 'empty.txt'
+        run_program(['--exec', 'matches zzz', '-s', 'tests/script.snagit', '-o', str(empty)])
+        assert not empty.exists()
+
+    def test_output_sink(self, tmp_path):
+        import gzip
+        from snagit.__main__ import run_program
+        out = tmp_path / 'out.txt.gz'
+        for i in range(2):
+            run_program([
+                '--exec', 'strip', '-s', 'tests/script.snagit', '-o', str(out),
+                '--append'
+            ])
+
+        with gzip.open(out, 'rt') as fp:
+            assert fp.read() == 'replace_each "" #\nreplace_each "" #'
+
+        out = tmp_path / 'out.txt'
+        run_program([
+            '--exec', 'load {0} {0} {0}\nstrip'.format('tests/script.snagit'),
+            '-o', str(out), '--rotate-count', '2'
+        ])
+        assert (tmp_path / 'out.1.txt').read_text() == (
+            'replace_each "" #\nreplace_each "" #'
+        )
+        assert (tmp_path / 'out.2.txt').read_text() == 'replace_each "" #'
+
+        # Appending resumes rotation after the existing files
+        line = 'replace_each "" #'
+        args = [
+            '--exec', 'load {0} {0}\nstrip'.format('tests/script.snagit'),
+            '-o', str(tmp_path / 'app.txt'), '--append'
+        ]
+        for i in range(2):
+            run_program(args + ['--rotate-count', '2'])
+            run_program(args + ['--rotate-size', '30'])
+
+        assert [
+            (tmp_path / 'app.{}.txt'.format(i)).read_text().count(line)
+            for i in range(1, 5)
+        ] == [2, 2, 2, 2]
+        assert (tmp_path / 'app.2.txt').read_text() == '\n'.join([line] * 2)
+        assert not (tmp_path / 'app.5.txt').exists()
+
+        args[3] = str(tmp_path / 'more.txt')
+        for i in range(2):
+            run_program(args + ['--rotate-size', '100'])
+
+        assert (tmp_path / 'more.1.txt').read_text() == '\n'.join([line] * 4)
+
+
 class TestRepl:
     
     def test_repl(self, capsys):
@@ -1,7 +1,9 @@
 import re
+import sys
+import importlib.util
 import pytest
 from snagit import utils
-from snagit.core import execute_code
+from snagit.core import execute_code, Interpreter
 
 LINES = [
     'foo bar baz',
@@ -53,6 +55,81 @@ class TestLines:
         res = execute_code('matches r"(x|z)+"', data)
         assert res == 'xxxxxxxx\nzzzz'
 
+    def test_offsets(self, lines):
+        from snagit.lib.lines import Lines, index_lines
+        text = 'a\r\nb\rc\x0cd\n\ne'
+        starts, ends = index_lines(text, block=1)
+        assert [text[s:e] for s, e in zip(starts, ends)] == text.splitlines()
+
+        data = Lines(lines)
+        assert list(data) == LINES
+        assert data[2] == LINES[2] and list(data[-2:]) == LINES[-2:]
+        from snagit.lib.lines import skip_to, strip, matches
+        for cmd, args, kws in [
+            (skip_to, ['123'], {'keep': True}),
+            (strip, [], {}),
+            (matches, ['u'], {}),
+        ]:
+            result = cmd(iter([data]), args, kws)[0]
+            assert result._data is data._data
+
+        stripped = execute_code('strip\nmatches "1"', lines)
+        assert stripped == '123'
+        assert Lines(['a\nb', 'c']).find('a\nb') == 0
+
+    def test_matches_many(self, lines):
+        text = execute_code(r'matches zz 456 r"\s+1"', lines)
+        assert text == 'zzzz\n        123\n456'
+        assert execute_code('matches a b mode=all', lines) == 'foo bar baz'
+        assert execute_code('matches o a x 1 2 3 4 5 6 mode=none', lines) == 'zzzz'
+        assert execute_code('strip\nmatches r"\\w+\\d" invert=True', lines) == (
+            'foo bar baz\nspam\nxxxxxxxx\nzzzz'
+        )
+        assert execute_code('skip_to u6 12 keep=True', lines) == join_lines(-3)
+        assert execute_code('matches r"(?i)SPAM" r"(?i)ZZ"', lines) == (
+            'spam     \nzzzz'
+        )
+
+    def test_sort(self):
+        text = 'a10 3\nB 1.5\na2 -4\nb 1e1\na2 -4'
+        assert execute_code('sort', text) == 'B 1.5\na10 3\na2 -4\na2 -4\nb 1e1'
+        assert execute_code('sort natural=True reverse=True\nuniq', text) == (
+            'b 1e1\na10 3\na2 -4\nB 1.5'
+        )
+        assert execute_code('sort key=2 numeric=True', text) == (
+            'a2 -4\na2 -4\nB 1.5\na10 3\nb 1e1'
+        )
+        assert execute_code(r'sort key=r"\d+" natural=True', text) == (
+            'B 1.5\nb 1e1\na2 -4\na2 -4\na10 3'
+        )
+
+        from snagit.store import external_sort
+        words = [str(i * 7919 % 1000) for i in range(1000)]
+        assert list(external_sort(words, key=len, memory=1000)) == sorted(
+            words, key=len
+        )
+        # Runs are merged a few at a time, still stably
+        for width in (2, 3):
+            assert list(external_sort(
+                words, key=len, reverse=True, memory=200, width=width
+            )) == sorted(words, key=len, reverse=True)
+
+        # Unquoted sizes are read as a number and a stray argument
+        with pytest.raises(ValueError):
+            execute_code('sort memory=64M', text)
+
+        assert execute_code("count memory='64M'", text) == execute_code(
+            'count', text
+        )
+
+    def test_count_dedupe(self):
+        text = 'b\na\nb\nc\nb\na'
+        assert execute_code('count memory=10', text) == '2 a\n3 b\n1 c'
+        assert execute_code('dedupe', text) == 'b\na\nc'
+        assert execute_code('dedupe approximate=True capacity=10', text) == (
+            'b\na\nc'
+        )
+
     def test_merge(self):
         data = [LINES[:], LINES[:]]
         expect = '{}\n{}'.format(join_lines(), join_lines())
@@ -68,12 +145,29 @@ class TestText:
     def test_remove_each(self):
         assert 'a b c' == execute_code('remove_each x z', 'ax bx cz')
 
+    def test_replace_each_once(self):
+        # One pass, longest match first, without rescanning replacements
+        assert execute_code('replace_each b ab a', 'aab') == 'bb'
+        assert execute_code('remove_each b ac', 'abc') == 'ac'
+        assert execute_code(r'replace_each # r"\d+" 1', 'a1 b22') == 'a# b#'
+        assert execute_code(r'replace_each "<\1>" r"(\d)\d"', 'a12') == (
+            'a<1>'
+        )
+        assert execute_code('replace_each b a count=1', 'aa') == 'ba'
+
     def test_compress_text(self):
         assert 'a\nb c\nd' == execute_code('compress_text', '       a    \n\n\n\n b\t\tc\n\r\nd       ')
 
     def test_merge(self):
         assert 'a\nb\nc' == execute_code('merge', 'a b c'.split())
 
+    def test_slots(self):
+        from snagit.lib import DataProxy
+        data = DataProxy('abc')
+        assert not hasattr(data, '__dict__')
+        with pytest.raises(AttributeError):
+            data.upper
+
 
 
 def compress(text):
@@ -145,7 +239,404 @@ class TestSoup:
         text = execute_code('extract_empty', '<p>Hello, <i></i>world')
         assert compress('<p>Hello, world</p>') == compress(text)
 
+        from snagit.lib.soup import Soup, extract_empty
+        h = '<div><p> <b><i></i></b> </p><p><b class="x"></b>{}</p></div>'
+        soup = extract_empty(Soup(h.format(' a <i>\n</i>' * 500)), [], {})
+        assert str(soup._data) == '<div><p><b class="x"></b>{}</p></div>'.format(
+            ' a ' * 500
+        )
+
+    def test_normalize_wide(self):
+        from snagit.lib.soup import Soup, normalize_tag
+        h = '<p>{}</p>'.format(' a \n b <i> c  d </i>' * 500)
+        soup = Soup(h)
+        soup.build_index()
+        soup = normalize_tag(soup, [], {})
+        assert str(soup._data) == '<p>{}</p>'.format('a b<i>c d</i>' * 500)
+        assert len(soup.select('i')) == 500
+
+    def test_accessors(self):
+        from snagit.lib.soup import Soup
+        soup = Soup(html)
+        assert not hasattr(soup, '__dict__')
+        assert [el.name for el in soup.select('.foo')] == ['b']
+        assert [el.name for el in soup.find_all('p')] == ['p']
+        assert [el.name for el in soup.children] == ['p']
+
+    def test_parse(self):
+        from snagit.lib.soup import parse_markup
+        assert parse_markup(html, 'auto').p is not None
+        text = execute_code('parse html.parser\nselect b', html)
+        assert compress('<b class="foo">world</b>') == compress(text)
+
+        text = execute_code('parser auto\nunwrap b', html)
+        assert compress('world</p>') in compress(text)
+
+        # The parser is set for the script only
+        assert utils.get_config('parser') == 'html.parser'
+        interp = Interpreter(html)
+        interp.execute('parser auto\nselect b')
+        assert interp.contents.parser == 'auto'
+        assert Interpreter(html).contents.parser is None
+
+        # Only lxml and html5lib add the missing html and body tags
+        if any(importlib.util.find_spec(m) for m in ('lxml', 'html5lib')):
+            text = execute_code('parser auto\nparse', html)
+            assert '<html>' in text
+            assert '<html>' not in execute_code('parse', html)
+
+        text = execute_code('parser auto\nfind_all b class_=foo', html)
+        assert compress('<b class="foo">world</b>') == compress(text)
+
+    def test_parse_only(self):
+        from snagit.lib.soup import make_strainer
+        assert make_strainer('a + b') is None
+        assert make_strainer('p:first-child') is None
+
+        h = (
+            '<div><table class="x results"><tr><td>1</td></tr></table>'
+            '<table><tr><td>2</td></tr></table><p>3</p></div>'
+        )
+        text = execute_code('select "table.results tr"', h)
+        assert compress('<tr><td>1</td></tr>') == compress(text)
+
+        text = execute_code('select td parse_only=table.x', h)
+        assert compress('<td>1</td>') == compress(text)
+
+        text = execute_code('find_all p', h)
+        assert compress('<p>3</p>') == compress(text)
+
+        with pytest.raises(ValueError):
+            execute_code('select td parse_only="a + b"', h)
+
+        # Without parse_only, implicitly closed elements end where they would
+        # in a full parse
+        h2 = (
+            '<ul><li>1<li>2</ul><div class="a b">x</div>'
+            '<table><tr><td>3<td>4</tr></table><div><p>5<p>6</div><i>7</i>'
+        )
+        text = execute_code('select li', h2)
+        assert compress('<li>1<li>2</li></li><li>2</li>') == compress(text)
+        text = execute_code('select td', h2)
+        assert compress('<td>3<td>4</td></td><td>4</td>') == compress(text)
+        text = execute_code('find_all p', h2)
+        assert compress('<p>5<p>6</p></p><p>6</p>') == compress(text)
+
+        # No matches keep the document unchanged, whatever the parser
+        full = execute_code('parse', h)
+        assert execute_code('select span', h) == full
+        assert execute_code('find_all span', h) == full
+        assert execute_code('select td parse_only=span', h) == full
+        assert execute_code('parser auto\nselect span', h) == (
+            execute_code('parser auto\nparse', h)
+        )
+
+    def test_select_stream(self):
+        h = (
+            '<table class="results"><tr><td>1<td>a &amp; b</tr>'
+            '<tr><td>2</td></tr></table><ul><li>x<li>y<br>z</ul>'
+        )
+        text = execute_code('select_stream "table.results > tr"', h)
+        assert compress(
+            '<tr><td>1</td><td>a & b</td></tr>\n<tr><td>2</td></tr>'
+        ) == compress(text)
+
+        from snagit.core import Interpreter
+        interp = Interpreter(h)
+        interp.execute('select_stream li')
+        assert [str(s) for s in interp.contents] == [
+            '<li>x</li>',
+            '<li>\n    y\n    <br>\n    z\n</li>'
+        ]
+
+    def test_select_stream_source(self, tmp_path):
+        from snagit.core import Interpreter
+        import io
+        import pickle
+        from snagit.lib.lines import LineStream
+        from snagit.lib.soup import SoupStream
+        filename = tmp_path / 'big.html'
+        filename.write_text('<ul>\n{}</ul>'.format(''.join(
+            '<li class="{}">{}</li>\n'.format('odd' if i % 2 else 'even', i)
+            for i in range(4000)
+        )))
+        interp = Interpreter()
+        interp.execute('load {} stream=True'.format(filename))
+        assert isinstance(interp.contents.contents[0], LineStream)
+        interp.execute('select_stream li.odd')
+        assert len(interp.contents) == 1
+        stream = interp.contents.contents[0]
+        assert isinstance(stream, SoupStream)
+        soups = list(stream)
+        assert len(soups) == 2000
+        assert str(soups[-1]) == '<li class="odd">3999</li>'
+        assert pickle.loads(pickle.dumps(stream)).size() == 0
+
+        out = io.StringIO()
+        interp.contents.write(out)
+        assert out.getvalue() == '\n'.join(str(soup) for soup in soups)
+
+        # Matches are read and parsed only as the stream is consumed
+        read = []
+
+        def source():
+            for line in filename.read_text().splitlines():
+                read.append(line)
+                yield line
+
+        interp = Interpreter([LineStream(source)])
+        interp.execute('select_stream li.odd')
+        assert str(next(iter(interp.contents.contents[0]))) == (
+            '<li class="odd">1</li>'
+        )
+        assert 0 < len(read) < 4000
+
+        interp = Interpreter()
+        interp.execute('load {} stream=True\nparser auto'.format(filename))
+        interp.execute('select_stream li.odd\nselect_stream li\nmerge')
+        assert str(interp.contents).count('<li') == 2000
+
+    def test_compile_selector(self):
+        from snagit.lib.soup import Soup, compile_selector
+        assert compile_selector('p > b') is compile_selector('p > b')
+        ns = {'x': 'http://example.com'}
+        assert compile_selector('x|a', ns) is compile_selector('x|a', dict(ns))
+        soup = Soup(html)
+        assert soup.select('p > b') == soup._data.select('p > b')
+        assert soup.select('p > b', limit=1) == soup._data.select('p > b')
+
+    def test_format_deep(self):
+        from snagit.lib.soup import Soup
+        depth = sys.getrecursionlimit() + 100
+        soup = Soup('<b>' * depth + 'x' + '</b>' * depth)
+        lines = str(soup).splitlines()
+        assert len(lines) == 2 * depth - 1
+        assert lines[depth - 1].strip() == '<b>x</b>'
+
+    def test_render_cache(self):
+        from snagit.lib.soup import Soup, extract
+        soup = Soup(html)
+        # Sizing a parsed soup uses its source rather than rendering it
+        assert soup.size() == len(html) and soup._rendered is None
+        text = str(soup)
+        assert str(soup) is text
+        assert soup.size() == len(text)
+
+        # Handing out elements drops the cache, without relying on changed()
+        soup.select('b')[0].extract()
+        assert compress(str(soup)) == compress('<p>Hello,</p>')
+        next(soup.children).append('!')
+        assert compress(str(soup)) == compress('<p>Hello,!</p>')
+        assert str(soup) is str(soup)
+
+        result = extract(Soup(html), ['b'], {})
+        assert compress(str(result)) == compress('<p>Hello,</p>')
+
+    def test_write(self, tmp_path):
+        out = tmp_path / 'out.html'
+        execute_code('write {}'.format(out), [html, html])
+        assert out.read_text() == '\n'.join([execute_code('', html)] * 2)
+
+        execute_code('write {} raw=True'.format(out), html)
+        assert out.read_text() == html
+
+        # Empty contents still truncate the file, unless appending
+        execute_code('write {} append=True'.format(out), [])
+        assert out.read_text() == html
+        execute_code('write {}'.format(out), [])
+        assert out.read_text() == ''
+
+        execute_code('write {} rotate_size=10 append=True'.format(out), [
+            'abc', 'defghijklmn', 'op'
+        ])
+        assert (tmp_path / 'out.1.html').read_text() == 'abc\ndefghijklmn'
+        assert (tmp_path / 'out.2.html').read_text() == 'op'
+
+    def test_sanitize(self):
+        h = (
+            '<div align="left" class="x"><center>a</center>'
+            '<applet code="a"><p>b</p></applet><font face="f">c</font></div>'
+        )
+        text = execute_code('sanitize face', h)
+        assert compress(
+            '<div class="x"><span>a</span><span>c</span></div>'
+        ) == compress(text)
+
+        text = execute_code(
+            'sanitize global_attrs=True attrs=face tags=j\'{"font": "em"}\'',
+            h
+        )
+        assert compress(
+            '<div align="left"><center>a</center><applet code="a"><p>b</p>'
+            '</applet><em>c</em></div>'
+        ) == compress(text)
+
+    def test_extract_records(self, tmp_path):
+        h = (
+            '<div class="item"><h2><a href="/a">A  title</a></h2>'
+            '<span class="price">1</span></div>'
+            '<div class="item"><h2><a>B</a></h2></div>'
+        )
+        script = 'extract_records .item title="h2 a" url="h2 a@href" price=.price'
+        text = execute_code(script, h)
+        assert text.splitlines() == [
+            '{"title": "A title", "url": "/a", "price": "1"}',
+            '{"title": "B", "url": null, "price": null}',
+        ]
+
+        out = tmp_path / 'out.csv'
+        execute_code('{}\nwrite {} format=csv'.format(script, out), h)
+        assert out.read_text() == 'title,url,price\nA title,/a,1\nB,,\n'
+
+        execute_code('{}\nwrite {} format=csv'.format(script, out), [h, h])
+        assert out.read_text() == (
+            'title,url,price\nA title,/a,1\nB,,\nA title,/a,1\nB,,\n'
+        )
+
+    def test_index(self):
+        from snagit.lib.soup import Soup
+        h = utils.read_file('tests/some.html')
+        soup = Soup(h)
+        soup.build_index()
+        plain = Soup(h)
+        for sel in ['li', '.abc', 'li.abc', 'td', '#nope', 'tr > td', 'a']:
+            assert soup.select(sel) == plain.select(sel)
+
+        h2 = '<div id="main"><p id="x" class="a b">1</p><p class="a">2</p></div>'
+        indexed, plain2 = Soup(h2), Soup(h2)
+        indexed.build_index()
+        for sel in [
+            '#main.foo', '#main.a.b', 'div#main.a', '#x.a', '#x.a.b',
+            'p#x.b', 'p#x.c', 'div#x.a', '.a.b', 'p.a'
+        ]:
+            assert indexed.select(sel) == plain2.select(sel)
+
+        script = 'extract .abc td\nunwrap ul\nreplace_with th x\nselect tr'
+        expect = execute_code(script, h)
+        assert execute_code('index\n' + script, h) == expect
+
+        # Copies and changed trees rebuild the index on the next lookup
+        copied = Soup(soup)
+        assert copied._index is True
+        assert copied.select('li') == Soup(h).select('li')
+        assert copied._index is not True
+        copied.changed()
+        assert copied._index is True
+        copied.drop_index()
+        assert copied._index is None
+        assert execute_code('index\nremove_attrs class\nselect .abc', h) == (
+            execute_code('remove_attrs class\nselect .abc', h)
+        )
+
+    def test_merge(self):
+        from snagit.lib.soup import Soup
+        docs = [Soup('<p>{}</p><b>x</b>'.format(i)) for i in range(3)]
+        expect = '\n'.join('<p>{}</p>\n<b>x</b>'.format(i) for i in range(3))
+        assert str(Soup.merge(docs)) == expect
+        assert str(docs[0]) == '<p>0</p>\n<b>x</b>'
+
+        for doc in docs:
+            doc.release()
+        merged = Soup.merge(docs)
+        assert str(merged) == expect
+        assert Soup(merged)._data is not merged._data
+        merged.release()
+        assert Soup(merged)._data is merged._data
+
     def test_find_all(self):
         h = '<span foo="bar"><b class="b"></b><i class="i" data-foo-bar="#"></i></span>'
         text = execute_code('find_all b', h)
         assert compress('<b class="b"></b>') == compress(text)
+
+
+class TestTree:
+
+    def setup_method(self):
+        pytest.importorskip('lxml')
+
+    def test_tree(self):
+        from snagit.lib.tree import Tree
+        h = utils.read_file('tests/some.html')
+        tree = Tree(h)
+        assert not hasattr(tree, '__dict__')
+        assert len(tree.select('li.abc')) == 3
+        assert execute_code('tree\ncss li.abc\ntext', h) == 'line 1\nline 2\nline 5'
+        assert execute_code('tree\nxpath //li[@class="efg"]/a/@href', h) == (
+            '/xyz/foo3\n/xyz/foo4'
+        )
+        assert execute_code('tree\nxpath count(//li)', h) == '6.0'
+
+        # results are detached, so absolute paths stay within each result
+        assert execute_code('tree\ncss ul\nxpath count(//li)', h) == '6.0'
+        assert execute_code('tree\ncss li\nxpath count(//a)', h) == (
+            '1.0\n1.0\n1.0\n1.0\n0.0\n0.0'
+        )
+
+    def test_extract(self):
+        h = '<b>x</b> a <i>y</i> b<p>c <i>z</i> d</p>'
+        assert execute_code('tree\nextract i', h) == '<b>x</b> a \n b\n<p>c  d</p>'
+        assert execute_code('tree\nextract //p/i', h) == (
+            '<b>x</b> a \n<i>y</i> b\n<p>c  d</p>'
+        )
+
+    def test_convert(self):
+        h = utils.read_file('tests/some.html')
+        soup = execute_code('select "li > a"', h)
+        assert execute_code('tree\ncss "li > a"\nparse', h) == soup
+        assert execute_code('parse\ntree\ncss "li > a"\nparse', h) == soup
+        assert execute_code('tree\ncss "li > a"\nmerge\ntext', h) == (
+            execute_code('tree\ncss "li > a"\ntext', h)
+        )
+
+
+class TestJson:
+
+    data = {'results': [
+        {'id': i, 'name': 'n{}'.format(i), 'meta': {'ok': i % 2 == 0}}
+        for i in range(4)
+    ]}
+
+    def test_query(self):
+        import json
+        text = json.dumps(self.data)
+        assert execute_code('json\nquery results.*.name', text) == (
+            '["n0", "n1", "n2", "n3"]'
+        )
+        assert execute_code('json\nquery results.-1.id', text) == '3'
+        assert execute_code('json\nquery results\npluck id', text) == '[0, 1, 2, 3]'
+        assert execute_code('json\nquery results\nfilter meta__ok=True\npluck name', text) == (
+            '["n0", "n2"]'
+        )
+        assert execute_code('json\nquery results\nfilter name=r"[13]"\npluck id', text) == (
+            '[1, 3]'
+        )
+        assert execute_code('json j\'[{"a": {"b": 1}}, {"a": 2}]\'\nflatten') == (
+            '{"a.b": 1}\n{"a": 2}'
+        )
+
+    def test_strings(self):
+        import json
+        import pickle
+        from snagit.lib.jsondata import Json
+        text = json.dumps(self.data)
+        assert execute_code('json\nquery results.0.name', text) == '"n0"'
+        assert execute_code('json\nquery results.0.name\nquery', text) == '"n0"'
+        assert execute_code('json j\'"abc"\'') == '"abc"'
+        assert execute_code('json j\'["a", "b"]\'\nfilter') == '["a", "b"]'
+        value = pickle.loads(pickle.dumps(Json.wrap('{}')))
+        assert str(value) == '"{}"'
+
+    def test_stream(self):
+        import json
+        from snagit.lib.jsondata import iter_values
+        items = [{'x': i, 's': 'y' * i} for i in range(50)] + [123, 1.5, None]
+        text = json.dumps(items)
+        for size in (1, 7, 64):
+            chunks = [text[i:i + size] for i in range(0, len(text), size)]
+            assert list(iter_values(chunks)) == items
+
+        lines = '\n'.join(json.dumps(item) for item in items)
+        assert list(iter_values([lines])) == items
+        assert execute_code('json stream=True\nquery x', text[:40] + ']') == '0\n1'
+        with pytest.raises(ValueError):
+            list(iter_values(['[1, 2']))
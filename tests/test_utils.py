@@ -46,6 +46,46 @@ def test_read_file():
     assert text.startswith("'''\nTest snagit.utils")
 
 
+def test_parse_size():
+    assert utils.parse_size(100) == 100
+    assert utils.parse_size('2k') == 2048
+    assert utils.parse_size('1.5M') == 1572864
+    assert utils.parse_size('2GB') == 2 * 1024 ** 3
+    with pytest.raises(ValueError):
+        utils.parse_size('lots')
+
+
 def test_set_config():
     utils.set_config(bad_tags='bad_tags')
     assert utils.get_config('bad_tags') == 'bad_tags'
+
+
+def test_matcher():
+    import pickle
+    words = ['foo', 'foobar', 'fob', 'baz', 'a.b']
+    regex = re.compile(utils.trie_regex(words))
+    for line in ['xfoo', 'fo', 'bazz', 'a.b', 'axb', '']:
+        assert bool(regex.search(line)) == any(w in line for w in words)
+
+    matcher = utils.Matcher(['x', re.compile('(a|b)+c'), re.compile('z')])
+    assert [matcher(s) for s in ['abc', 'zz', 'yx', 'y', 'cab']] == [
+        True, True, True, False, False
+    ]
+    assert utils.Matcher(['a', 'b'], mode='all')('ba')
+    assert not utils.Matcher(['a', 'b'], mode='all')('a')
+    assert utils.Matcher(['a', 'b'], mode='none')('c')
+    assert not utils.Matcher(['a'], invert=True)('a')
+    assert pickle.loads(pickle.dumps(matcher))('abc')
+    flagged = utils.Matcher([re.compile('(?i)foo'), re.compile('(?i)bar')])
+    assert flagged.regex is None
+    assert flagged('BAR baz') and flagged('Foo') and not flagged('baz')
+    with pytest.raises(ValueError):
+        utils.Matcher(['a'], mode='some')
+
+
+def test_bloom_filter():
+    bloom = utils.BloomFilter(1000, 0.01)
+    assert all(bloom.add(str(i)) for i in range(0, 2000, 2))
+    assert not bloom.add('0')
+    assert all(str(i) in bloom for i in range(0, 2000, 2))
+    assert sum(str(i) in bloom for i in range(1, 2000, 2)) < 50